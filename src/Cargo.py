@@ -1,12 +1,92 @@
 import time
+import types
+import itertools
+from array import array
+
+# Shared names tuples, cargos from the same node all hold the same one
+_names = {}
+_NAMES_MAX = 4096
+
+# encoded of a cargo, frames encoded for a subscriber are in its view
+_NOT_ENCODED = types.MappingProxyType({})
+
+# Largest int held exactly by a float
+_FLOAT_INT_MAX = 2**53
+
+
+def _intern_names(names):
+    if not isinstance(names, (list, tuple)):
+        return names
+    try:
+        key = tuple(names)
+        shared = _names.get(key)
+    except TypeError:
+        return names
+    if shared is None:
+        if len(_names) >= _NAMES_MAX:
+            _names.clear()
+        shared = _names[key] = key
+    return shared
+
+
+def _typed_values(values):
+    """Return (values, ints) with values held in an array if possible.
+
+    A list of ints is held in an array('q'), a list of floats in an
+    array('d'). ints is True for an array('d') built from a list of ints and
+    non integral floats, such as decoded values, whose integral values are
+    to be read back as ints. Anything else is returned as is.
+
+    """
+
+    if type(values) is not list or not values:
+        return values, False
+    value_types = set(map(type, values))
+    if value_types == {int}:
+        try:
+            return array('q', values), False
+        except OverflowError:
+            return values, False
+    if value_types == {float}:
+        return array('d', values), False
+    if value_types == {int, float}:
+        for val in values:
+            if type(val) is int:
+                if not -_FLOAT_INT_MAX <= val <= _FLOAT_INT_MAX:
+                    return values, False
+            elif val % 1 == 0:
+                return values, False
+        return array('d', values), True
+    return values, False
+
+
+"""class EmonHubCargo
+
+Data passed from interfacer to interfacer. Many are in flight or buffered in
+channels at once, so it is kept compact: attributes are slots, numerical
+realdata is held in a typed array and names are shared tuples.
+
+Assign realdata and names rather than modifying them in place. realdata is
+read back as the array holding the values, or, for values whose integral
+ones are ints, as a tuple built from it, names as a tuple: in place changes
+either apply to the cargo or raise, they are never silently lost.
+
+Once published a cargo is frozen, see EmonHubFrozenCargo, so that the same
+object can be routed to any number of subscribers.
+
+"""
 
 class EmonHubCargo:
-    uri = 0
+
+    __slots__ = ('uri', 'timestamp', 'target', 'nodeid', 'nodename', 'rssi', 'rawdata',
+                 'realdatacodes', '_names', '_realdata', '_ints')
+
+    # next() of itertools.count is atomic, unlike incrementing a counter
+    _uris = itertools.count(1)
 
     # The class "constructor" - It's actually an initializer
     def __init__(self, timestamp, target, nodeid, nodename, names, realdata, rssi, rawdata):
-        EmonHubCargo.uri += 1
-        self.uri = EmonHubCargo.uri
+        self.uri = next(EmonHubCargo._uris)
         self.timestamp = float(timestamp)
         self.target = int(target)
         self.nodeid = int(nodeid)
@@ -20,8 +100,206 @@ class EmonHubCargo:
         # self.scale = 0
         # self.scales = []
         self.rawdata = rawdata
-        self.encoded = {}
-        # self.realdatacodes = []
+        self.realdatacodes = None
+
+    @property
+    def names(self):
+        return self._names
+
+    @names.setter
+    def names(self, names):
+        self._names = _intern_names(names)
+
+    @property
+    def realdata(self):
+        if self._ints:
+            # A tuple, an in place change to a copy would be lost
+            return tuple([int(val) if val % 1 == 0 else val for val in self._realdata])
+        return self._realdata
+
+    @realdata.setter
+    def realdata(self, values):
+        self._realdata, self._ints = _typed_values(values)
+
+    @property
+    def encoded(self):
+        # Frames encoded for a subscriber are held by its EmonHubCargoView
+        return _NOT_ENCODED
+
+    def freeze(self):
+        """Make the cargo read-only, done when it is published."""
+        self.__class__ = EmonHubFrozenCargo
+
+    def __setstate__(self, state):
+        # Unpickled, eg received from a worker process
+        for key, value in state[1].items():
+            object.__setattr__(self, key, value)
+        object.__setattr__(self, '_names', _intern_names(self._names))
+
+
+"""class EmonHubFrozenCargo
+
+A published cargo, shared by all the subscribers of its channel: any
+attribute assignment raises AttributeError. A subscriber attaches its own
+data, such as encoded frames, with an EmonHubCargoView.
+
+"""
+
+class EmonHubFrozenCargo(EmonHubCargo):
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("cargo " + str(self.uri) + " is published and read-only, can't set " + name)
+
+    def __delattr__(self, name):
+        raise AttributeError("cargo " + str(self.uri) + " is published and read-only, can't delete " + name)
+
+    def freeze(self):
+        pass
+
+
+"""class EmonHubCargoView
+
+A subscriber's view of a cargo: reads through to the cargo and holds the
+subscriber's own data on the side.
+
+cargo (EmonHubCargo): the shared cargo
+encoded (dict): frames encoded for sending, by interfacer name
+
+"""
+
+class EmonHubCargoView:
+
+    __slots__ = ('cargo', 'encoded')
+
+    def __init__(self, cargo, encoded):
+        self.cargo = cargo
+        self.encoded = encoded
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in EmonHubCargoView.__slots__:
+            raise AttributeError(name)
+        return getattr(self.cargo, name)
+
+
+"""class EmonHubFrameBatch
+
+Frames read in a burst, moved through the channels and into buffers as a
+single item. Frames are held by column: timestamp, nodeid, target, rssi
+and uri arrays and a list of the raw frames, with, for each layout (nodename, names, number and type
+of values), the values of its frames one after the other in a single
+array, a matrix of one row per frame.
+
+Subscribers share the batch and must not modify it. rows() gives the
+frames in the buffer format, cargos() rebuilds them as frozen cargos.
+
+"""
+
+class EmonHubFrameBatch:
+
+    __slots__ = ('uris', 'timestamps', 'nodeids', 'targets', 'rssis', 'rawdatas', 'layout_ids', 'layouts', 'values',
+                 '_index')
+
+    def __init__(self):
+        self.uris = array('q')
+        self.timestamps = array('d')
+        self.nodeids = array('q')
+        self.targets = array('q')
+        self.rssis = array('q')
+        self.rawdatas = []
+        # Index in layouts of each frame
+        self.layout_ids = array('q')
+        # (nodename, names, number of values, array typecode or None, ints)
+        self.layouts = []
+        # Values of the frames of each layout, an array or a list of lists
+        self.values = []
+        self._index = {}
+
+    @classmethod
+    def from_cargos(cls, cargos):
+        batch = cls()
+        for cargo in cargos:
+            batch.append(cargo)
+        return batch
+
+    def append(self, cargo):
+        values = cargo._realdata
+        typecode = values.typecode if isinstance(values, array) else None
+        key = (cargo.nodename, id(cargo.names), len(values), typecode, cargo._ints)
+        layout_id = self._index.get(key)
+        if layout_id is None:
+            layout_id = self._index[key] = len(self.layouts)
+            self.layouts.append((cargo.nodename, cargo.names, len(values), typecode, cargo._ints))
+            self.values.append(array(typecode) if typecode else [])
+        if typecode:
+            self.values[layout_id].extend(values)
+        else:
+            self.values[layout_id].append(list(values))
+
+        self.uris.append(cargo.uri)
+        self.timestamps.append(cargo.timestamp)
+        self.nodeids.append(cargo.nodeid)
+        self.targets.append(cargo.target)
+        self.rssis.append(cargo.rssi)
+        self.rawdatas.append(cargo.rawdata)
+        self.layout_ids.append(layout_id)
+
+    def __len__(self):
+        return len(self.uris)
+
+    def _frame_values(self):
+        """Yield the values of each frame, as held by the cargo, and if the
+        integral ones are to be read as ints."""
+
+        offsets = [0] * len(self.layouts)
+        for layout_id in self.layout_ids:
+            nodename, names, count, typecode, ints = self.layouts[layout_id]
+            offset = offsets[layout_id]
+            if typecode:
+                offsets[layout_id] = offset + count
+                yield self.values[layout_id][offset:offset + count], ints
+            else:
+                offsets[layout_id] = offset + 1
+                yield self.values[layout_id][offset], False
+
+    def rows(self):
+        """Return the frames as buffer items: [timestamp, nodeid, values..., rssi]"""
+
+        rows = []
+        for i, (values, ints) in enumerate(self._frame_values()):
+            row = [self.timestamps[i], self.nodeids[i]]
+            if ints:
+                row.extend([int(val) if val % 1 == 0 else val for val in values])
+            else:
+                row.extend(values)
+            if self.rssis[i]:
+                row.append(self.rssis[i])
+            rows.append(row)
+        return rows
+
+    def cargos(self):
+        """Return the frames as frozen cargos."""
+
+        cargos = []
+        for i, (values, ints) in enumerate(self._frame_values()):
+            nodename, names = self.layouts[self.layout_ids[i]][:2]
+            cargo = object.__new__(EmonHubCargo)
+            cargo.uri = self.uris[i]
+            cargo.timestamp = self.timestamps[i]
+            cargo.target = self.targets[i]
+            cargo.nodeid = self.nodeids[i]
+            cargo.nodename = nodename
+            cargo.rssi = self.rssis[i]
+            cargo.rawdata = self.rawdatas[i]
+            cargo.realdatacodes = None
+            cargo._names = names
+            cargo._realdata = values
+            cargo._ints = ints
+            cargo.freeze()
+            cargos.append(cargo)
+        return cargos
+
 
-def new_cargo(rawdata="", nodename=False, names=[], realdata=[], nodeid=0, timestamp=0.0, target=0, rssi=0.0):
+def new_cargo(rawdata="", nodename=False, names=(), realdata=(), nodeid=0, timestamp=0.0, target=0, rssi=0.0):
     return EmonHubCargo(timestamp or time.time(), target, nodeid, nodename, names, realdata, rssi, rawdata)
@@ -11,6 +11,7 @@
 
 import sys
 import time
+import threading
 import logging
 import logging.handlers
 import signal
@@ -23,6 +24,8 @@ from collections import defaultdict
 import emonhub_setup as ehs
 import emonhub_coder as ehc
 import emonhub_interfacer as ehi
+import emonhub_async as ehas
+import emonhub_worker as ehw
 from interfacers import *
 
 # this namespace and path
@@ -51,6 +54,9 @@ class EmonHub:
 
     __version__ = "emonHub (emon-pi variant) v2.1.5"
 
+    # Where buffered data left on exit is saved, unless set by persist_path
+    _default_persist_path = "/var/lib/emonhub"
+
     def __init__(self, setup):
         """Setup an OpenEnergyMonitor emonHub.
 
@@ -74,6 +80,27 @@ class EmonHub:
         # Initialize Interfacers
         self._interfacers = {}
 
+        # Set by the interfacers each time cargo is published
+        self._wakeup = threading.Event()
+
+        # Routing table: pub channel name -> list of subscriber queues
+        self._routes = {}
+
+        # Worker processes hosting the interfacers with a 'process' setting
+        self._workers = {}
+
+        # Seconds to wait for an interfacer to stop when deleting or rebuilding it
+        self._stop_timeout = 10
+
+        # Interfacers that failed to start: name -> time of the last attempt,
+        # they are retried every _retry_interval seconds
+        self._failed = {}
+        self._retry_interval = 60
+
+        # Seconds allowed to flush the buffers on exit, where to save what is left
+        self._shutdown_timeout = 20
+        self._persist_path = self._default_persist_path
+
         # Update settings
         self._update_settings(settings)
 
@@ -85,46 +112,40 @@ class EmonHub:
 
         """
 
-        # Set signal handler to catch SIGINT and shutdown gracefully
+        # Set signal handler to catch SIGINT and SIGTERM (systemd stop) and shutdown gracefully
         signal.signal(signal.SIGINT, self._sigint_handler)
+        signal.signal(signal.SIGTERM, self._sigint_handler)
 
         # Initialise thread restart counters
         restart_count = defaultdict(int)
 
+        # Initialise channel stats timestamp
+        stats_timestamp = time.time()
+
         # Until asked to stop
         while not self._exit:
 
             # Run setup and update settings if modified
             self._setup.run()
-            if self._setup.check_settings():
-                self._update_settings(self._setup.settings)
+            changed = self._setup.check_settings()
+            # Retry the interfacers that failed to start, even if unchanged
+            now = time.time()
+            retry = {('interfacers', name) for name, failed in self._failed.items()
+                     if now - failed >= self._retry_interval}
+            if retry and changed is not True:
+                changed = retry | (changed or set())
+            if changed:
+                self._update_settings(self._setup.settings, changed)
 
             # For all Interfacers
             kill_list = []
             for I in self._interfacers.values():
                 # Check threads are still running
-                if not I.isAlive():
+                if not I.is_alive():
                     kill_list.append(I.name) # <-avoid modification of iterable within loop
 
-                # Read each interfacers pub channels
-                for pub_channel in I._settings['pubchannels']:
-
-                    if pub_channel in I._pub_channels and len(I._pub_channels[pub_channel]) > 0:
-                        # POP cargo item (one at a time)
-                        cargo = I._pub_channels[pub_channel].pop(0)
-
-                        # Post to each subscriber interface
-                        for sub_interfacer in self._interfacers.values():
-                            # For each subsciber channel
-                            for sub_channel in sub_interfacer._settings['subchannels']:
-                                # If channel names match
-                                if sub_channel == pub_channel:
-                                    # init if empty
-                                    if sub_channel not in sub_interfacer._sub_channels:
-                                        sub_interfacer._sub_channels[sub_channel] = []
-
-                                    # APPEND cargo item
-                                    sub_interfacer._sub_channels[sub_channel].append(cargo)
+            # Pass the published cargo on to the subscribers
+            self._route()
 
             # ->avoid modification of iterable within loop
             for name in kill_list:
@@ -132,37 +153,120 @@ class EmonHub:
 
                 # The following should trigger a restart ... unless the
                 # interfacer is also removed from the settings table.
-                del self._interfacers[name]
+                # Its successor takes its buffer over but not its connections,
+                # they may be what killed it.
+                dead = self._interfacers.pop(name)
+                dead._reusable = False
+                ehi.handover[name] = dead
 
                 # Trigger restart by calling update settings
                 self._log.warning("Attempting to restart thread " + name + " (thread has been restarted " + str(restart_count[name]) + " times...")
                 restart_count[name] += 1
                 self._update_settings(self._setup.settings)
 
-            # Sleep until next iteration
-            time.sleep(0.2)
+            # Log channel counters once a minute, to help sizing the channels
+            if time.time() - stats_timestamp >= 60:
+                stats_timestamp = time.time()
+                for I in self._interfacers.values():
+                    for channel, stats in I.channel_stats().items():
+                        self._log.debug("%s %s channel stats: %s" % (I.name, channel, stats))
+
+            # Sleep until some cargo is published or the next settings check is due
+            if self._wakeup.wait(1):
+                self._wakeup.clear()
+
+    def _route(self):
+        """Move the cargo published by the interfacers to their subscribers."""
+
+        # Routing table is rebuilt by _update_settings, use the current one
+        routes = self._routes
+
+        for I in self._interfacers.values():
+            # Read each interfacers pub channels
+            for pub_channel in I._settings['pubchannels']:
+
+                if pub_channel in I._pub_channels:
+                    # POP all pending cargo items at once
+                    cargos = I._pub_channels[pub_channel].get_all()
+                    if not cargos:
+                        continue
+
+                    # APPEND the cargo items to the subscribers queues, this wakes them up.
+                    # Published cargo is read-only, all the subscribers share it
+                    for sub_channel in routes.get(pub_channel, ()):
+                        sub_channel.put_many(cargos)
 
     def close(self):
-        """Close hub. Do some cleanup before leaving."""
+        """Close hub. Do some cleanup before leaving.
+
+        Within shutdown_timeout seconds, input stops being read, the cargo
+        already published is delivered, the interfacers flush their buffers
+        and whatever could not be sent is saved in persist_path to be sent
+        after the next start.
+
+        """
 
         self._log.info("Exiting hub...")
+        deadline = time.time() + self._shutdown_timeout
+        interfacers = list(self._interfacers.values())
 
-        for I in self._interfacers.values():
+        # Readers first, then the threads
+        for I in interfacers:
+            I.drain()
+        for I in interfacers:
             I.stop = True
-            I.join()
+        for I in interfacers:
+            I.join(max(deadline - time.time(), 0))
+
+        # Deliver the cargo published meanwhile
+        self._route()
+
+        # Worker processes shut their interfacers down alongside the hub
+        for I in interfacers:
+            if I.process:
+                I.shutdown(deadline)
+        for worker in self._workers.values():
+            worker.shutdown(deadline, self._persist_path)
+
+        for I in interfacers:
+            if I.process:
+                continue
+            if I.is_alive():
+                self._log.warning(I.name + " did not stop in time, its buffer is lost")
+                continue
+            I.shutdown(deadline, self._persist_path)
+
+        # Stop the event loop hosting the async interfacers
+        ehas.EmonHubEventLoop.shutdown(5)
+
+        # Wait for the worker processes
+        for worker in self._workers.values():
+            worker.close(max(deadline - time.time(), 0) + 1)
 
         self._log.info("Exit completed")
         logging.shutdown()
 
-    def _sigint_handler(self, signal, frame):
-        """Catch SIGINT (Ctrl+C)."""
+    def _sigint_handler(self, signum, frame):
+        """Catch SIGINT (Ctrl+C) and SIGTERM."""
 
-        self._log.debug("SIGINT received.")
+        self._log.debug(signal.Signals(signum).name + " received.")
         # hub should exit at the end of current iteration.
         self._exit = True
 
-    def _update_settings(self, settings):
-        """Check settings and update if needed."""
+    def _update_settings(self, settings, changed=True):
+        """Check settings and update if needed.
+
+        changed (set): sections changed since the last update, as returned by
+        EmonHubFileSetup.check_settings(), True to check them all.
+
+        """
+
+        if changed is True:
+            def updated(*section):
+                return True
+        else:
+            def updated(*section):
+                return section in changed
 
         # EmonHub Logging level
         if 'loglevel' in settings['hub']:
@@ -170,11 +274,24 @@ class EmonHub:
         else:
             self._set_logging_level()
 
-        # Create a place to hold buffer contents whilst a deletion & rebuild occurs
-        self.temp_buffer = {}
+        # Shutdown deadline and persistence
+        try:
+            self._shutdown_timeout = float(settings['hub'].get('shutdown_timeout', 20))
+        except ValueError:
+            self._log.error("Invalid shutdown_timeout: " + str(settings['hub']['shutdown_timeout']))
+        self._persist_path = settings['hub'].get('persist_path', self._default_persist_path) or None
+
+        # Nodes, workers get their own copy before any cargo is sent to them
+        if 'nodes' in settings and updated('nodes'):
+            for node, error in ehc.load_nodes(settings['nodes']).errors:
+                self._log.error("Invalid settings for node " + node + ", its frames will be discarded: " + error)
+            for worker in self._workers.values():
+                worker.send('nodes', self._nodes_dict(settings['nodes']))
 
         # Interfacers
-        for name in self._interfacers:
+        for name in list(self._interfacers):
+            if not updated('interfacers', name):
+                continue
             # Delete interfacers if not listed or have no 'Type' in the settings without further checks
             # (This also provides an ability to delete & rebuild by commenting 'Type' in conf)
             if name in settings['interfacers'] and 'Type' in settings['interfacers'][name]:
@@ -187,43 +304,104 @@ class EmonHub:
                     self._log.error("Unable to update '" + name + "' configuration: " + str(e))
                     continue
                 else:
-                    # check init_settings against the file copy, if they are the same move on to the next
-                    if self._interfacers[name].init_settings == settings['interfacers'][name]['init_settings']:
+                    # check init_settings and worker process against the file copy, if they are the same move on to the next
+                    if self._interfacers[name].init_settings == settings['interfacers'][name]['init_settings'] \
+                            and self._interfacers[name].process == settings['interfacers'][name].get('process'):
                         continue
             # Delete interfacers if setting changed or name is unlisted or Type is missing
             self._log.info("Deleting interfacer '%s' ", name)
-            self._interfacers[name].stop = True
-            del self._interfacers[name]
+            I = self._interfacers.pop(name)
+            I.stop = True
+            I.join(self._stop_timeout)
+            if I.is_alive():
+                self._log.warning("Interfacer '%s' did not stop in time" % name)
+                I._reusable = False
+            # If rebuilt, its successor takes its buffer and connections over
+            ehi.handover[name] = I
+
+        # Interfacers no longer listed are not retried
+        for name in list(self._failed):
+            if 'Type' not in settings['interfacers'].get(name, {}):
+                del self._failed[name]
 
         for name, I in settings['interfacers'].items():
             # If interfacer does not exist, create it
+            if name in self._interfacers and not updated('interfacers', name):
+                continue
             if name not in self._interfacers:
                 try:
                     if 'Type' not in I:
                         continue
                     self._log.info("Creating " + I['Type'] + " '%s' ", name)
-                    # This gets the class from the 'Type' string
-                    interfacer = getattr(ehi, I['Type'])(name,**I['init_settings'])
+                    if 'process' in I:
+                        # Run in a worker process, represented here by a proxy
+                        worker = self._get_worker(I['process'], settings)
+                        interfacer = ehw.EmonHubProcessInterfacer(name, worker, I['Type'], I['init_settings'])
+                    else:
+                        # This gets the class from the 'Type' string
+                        interfacer = getattr(ehi, I['Type'])(name,**I['init_settings'])
+                    interfacer.process = I.get('process')
                     interfacer.set(**I['runtimesettings'])
                     interfacer.init_settings = I['init_settings']
+                    interfacer._pub_wakeup = self._wakeup
+                    interfacer.take_over()
+                    interfacer.restore(self._persist_path)
                     interfacer.start()
                 except ehi.EmonHubInterfacerInitError as e:
                     # If interfacer can't be created, log error and skip to next
                     self._log.error("Failed to create '" + name + "' interfacer: " + str(e))
+                    self._failed[name] = time.time()
                     continue
                 except Exception as e:
                     # If interfacer can't be created, log error and skip to next
                     self._log.error("Unable to create '" + name + "' interfacer: " + str(e))
+                    self._failed[name] = time.time()
                     continue
                 else:
                     self._interfacers[name] = interfacer
+                    self._failed.pop(name, None)
             else:
                 # Otherwise just update the runtime settings if possible
                 if 'runtimesettings' in I:
                     self._interfacers[name].set(**I['runtimesettings'])
 
-        if 'nodes' in settings:
-            ehc.nodelist = settings['nodes']
+        # Close what the interfacers deleted or rebuilt still hold
+        for name in list(ehi.handover):
+            ehi.handover.pop(name).close()
+
+        # Rebuild the routing table now the interfacers or their channels may have changed
+        self._update_routes()
+
+    def _update_routes(self):
+        """Build the pub channel -> subscriber queues routing table.
+
+        The topology only changes when settings are updated so the table is
+        built once here and swapped in a single assignment, run() then finds
+        the subscribers of a pub channel with one dictionary lookup.
+
+        """
+
+        routes = defaultdict(list)
+        for I in self._interfacers.values():
+            for sub_channel in I._settings['subchannels']:
+                routes[sub_channel].append(I._get_sub_channel(sub_channel))
+        self._routes = dict(routes)
+
+    def _get_worker(self, group, settings):
+        """Return the worker process named group, (re)starting it if needed."""
+
+        worker = self._workers.get(group)
+        if worker is None or not worker.is_alive():
+            worker = ehw.EmonHubWorker(group, self._log.getEffectiveLevel(), self._persist_path)
+            if 'nodes' in settings:
+                worker.send('nodes', self._nodes_dict(settings['nodes']))
+            self._workers[group] = worker
+        return worker
+
+    @staticmethod
+    def _nodes_dict(nodes):
+        """Plain dict copy of the nodes settings, to be sent to a worker."""
+        return nodes.dict() if hasattr(nodes, 'dict') else dict(nodes)
 
     def _set_logging_level(self, level='WARNING', log=True):
         """Set logging level.
@@ -249,6 +427,8 @@ class EmonHub:
         # Change level if different from current level
         if loglevel != self._log.getEffectiveLevel():
             self._log.setLevel(level)
+            for worker in getattr(self, '_workers', {}).values():
+                worker.send('loglevel', loglevel)
             if log:
                 self._log.info('Logging level set to %s' % level)
 
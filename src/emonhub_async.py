@@ -0,0 +1,269 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import time
+import asyncio
+import threading
+import traceback
+import concurrent.futures
+
+try:
+    import aiohttp
+    aiohttp_found = True
+except ImportError:
+    aiohttp_found = False
+
+from emonhub_interfacer import EmonHubInterfacer
+
+"""class EmonHubEventLoop
+
+Thread running the asyncio event loop hosting all the AsyncEmonHubInterfacer
+instances. It is started when the first async interfacer starts and stopped
+by the hub when it closes.
+
+"""
+
+class EmonHubEventLoop(threading.Thread):
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        super().__init__(name="asyncio", daemon=True)
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+
+    @classmethod
+    def get(cls):
+        """Return the running event loop thread, starting it if needed."""
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                cls._instance.start()
+            return cls._instance
+
+    @classmethod
+    def shutdown(cls, timeout=None):
+        """Stop the event loop thread, if running."""
+
+        with cls._instance_lock:
+            instance, cls._instance = cls._instance, None
+        if instance is not None:
+            instance.loop.call_soon_threadsafe(instance.loop.stop)
+            instance.join(timeout)
+
+
+"""class EmonHubAsyncWakeup
+
+Thread-safe way of setting an asyncio.Event living in the hub event loop,
+used as sub channel wakeup by async interfacers.
+
+"""
+
+class EmonHubAsyncWakeup:
+
+    def __init__(self, loop):
+        self._loop = loop
+        # Created in the event loop thread on first use
+        self._event = None
+
+    def _get_event(self):
+        if self._event is None:
+            self._event = asyncio.Event()
+        return self._event
+
+    def set(self):
+        self._loop.call_soon_threadsafe(lambda: self._get_event().set())
+
+    def clear(self):
+        self._get_event().clear()
+
+    def is_set(self):
+        return self._event is not None and self._event.is_set()
+
+    async def wait(self, timeout=None):
+        """Wait until set or timeout (seconds), return True if set."""
+        event = self._get_event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return event.is_set()
+
+
+"""class AsyncEmonHubInterfacer
+
+Base class for I/O bound interfacers running as coroutines on the hub's
+event loop rather than in a thread of their own, so that hundreds of
+devices can be polled without one thread each.
+
+The hub manages them just like thread based interfacers (start(), stop,
+is_alive(), join()). Subclasses implement the coroutines read(), send()
+and _process_post() and must never block: use asyncio streams, aiohttp
+or run_blocking() for libraries without asyncio support.
+
+"""
+
+class AsyncEmonHubInterfacer(EmonHubInterfacer):
+
+    def __init__(self, name):
+        super().__init__(name)
+
+        self._loop = EmonHubEventLoop.get().loop
+        self._wakeup = EmonHubAsyncWakeup(self._loop)
+        self._future = None
+
+    def start(self):
+        """Schedule the interfacer on the hub event loop."""
+        self._future = asyncio.run_coroutine_threadsafe(self._run(), self._loop)
+
+    def is_alive(self):
+        return self._future is not None and not self._future.done()
+
+    def join(self, timeout=None):
+        if self._future is not None:
+            concurrent.futures.wait([self._future], timeout)
+
+    async def _run(self):
+        """Run the interfacer, reading in a task of its own."""
+
+        reader = self._loop.create_task(self._read_loop())
+        try:
+            while not self.stop:
+                # Subscriber channels
+                for channel in self._settings["subchannels"]:
+                    if channel in self._sub_channels:
+                        for frame in self._sub_channels[channel].get_all():
+                            self._add_item(frame)
+
+                # Action reporter tasks
+                await self.action()
+
+                if reader.done():
+                    # Reading failed, let the hub restart the interfacer
+                    break
+
+                # Sleep until there is something to do
+                if await self._wakeup.wait(self._action_timeout()):
+                    self._wakeup.clear()
+        except Exception:
+            self._log.warning("Exception caught in " + self.name + " task. " + traceback.format_exc())
+        finally:
+            reader.cancel()
+
+    async def _read_loop(self):
+        """Read, process and publish input until stopped."""
+
+        try:
+            while not self.stop:
+                # Only read if there is a pub channel defined for the interfacer
+                if not len(self._settings["pubchannels"]) or self._draining:
+                    await asyncio.sleep(1)
+                    continue
+                rxc = await self.read()
+                if rxc:
+                    rxc = self._process_rx(rxc)
+                    if rxc:
+                        self._publish(rxc)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._log.warning("Exception caught in " + self.name + " task. " + traceback.format_exc())
+
+    async def read(self):
+        """Wait for and return an EmonHubCargo object, or None.
+
+        To be implemented in subclass, the default sleeps a second.
+
+        """
+        await asyncio.sleep(1)
+
+    async def send(self, cargo):
+        """Send data from interface.
+        Specific version to be created for each interfacer
+        Accepts an EmonHubCargo object
+        """
+        pass
+
+    async def action(self):
+        """Flush the buffer when due."""
+
+        # pause output if 'pause' set to 'all' or 'out'
+        if str(self._settings['pause']).lower() in ['all', 'out']:
+            return
+
+        # If an interval is set, check if that time has passed since last post
+        if int(self._settings['interval']) \
+                and time.time() - self._interval_timestamp < int(self._settings['interval']):
+            return
+        await self.flush()
+
+    async def flush(self):
+        """Send oldest data in buffer, if any."""
+
+        if self.buffer.hasItems():
+            self._log.debug("Buffer size: " + str(self.buffer.size()))
+
+            max_items = min(int(self._settings['batchsize']), self._item_limit)
+            if max_items <= 0:
+                return
+
+            databuffer = self.buffer.retrieveItems(max_items)
+            retrievedlength = len(databuffer)
+            if await self._process_post(databuffer):
+                # In case of success, delete sample set from buffer
+                self.buffer.discardLastRetrievedItems(retrievedlength)
+            self._interval_timestamp = time.time()
+
+    def _post_batch(self, databuffer):
+        # Called from the hub thread on shutdown, the event loop is still running
+        future = asyncio.run_coroutine_threadsafe(self._process_post(databuffer), self._loop)
+        try:
+            return future.result(30)
+        except Exception:
+            self._log.warning("Exception caught in " + self.name + " task. " + traceback.format_exc())
+            return False
+
+    async def _process_post(self, data):
+        """
+        To be implemented in subclass.
+
+        :return: True if data posted successfully and can be discarded
+        """
+        pass
+
+    async def _send_post(self, post_url, post_body=None):
+        """Send an HTTP request without blocking the event loop.
+
+        :return: the received reply if request is successful
+
+        """
+
+        if not aiohttp_found:
+            return await self.run_blocking(super()._send_post, post_url, post_body)
+
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+                if post_body:
+                    reply = await session.post(post_url, data=post_body)
+                else:
+                    reply = await session.get(post_url)
+                reply.raise_for_status()
+                return await reply.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+            self._log.warning(self.name + " couldn't send to server: " + str(ex))
+
+    async def run_blocking(self, func, *args):
+        """Run a blocking call in the event loop's thread pool."""
+        return await self._loop.run_in_executor(None, func, *args)
@@ -7,19 +7,88 @@
 
 """
 
+import collections
+import itertools
+import json
 import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+
+try:
+    import sqlite3
+    sqlite3_found = True
+except ImportError:
+    sqlite3_found = False
+
+try:
+    import lzma
+    lzma_found = True
+except ImportError:
+    lzma_found = False
+
+# Directory of the files of the persistent buffers, if not given
+DEFAULT_PATH = "/var/lib/emonhub"
+
+# What a full buffer does with its oldest items:
+#   drop-oldest      discard them
+#   downsample-mean  merge the frames of each node into buckets of 1 min, then
+#                    5 min, then 1 h as it fills up, averaging their values,
+#                    and only discard items if that is not enough
+#   downsample-sum   same, summing the values, eg for pulse counts
+# Only the memory and compact buffers downsample, the others drop.
+OVERFLOW_POLICIES = ('drop-oldest', 'downsample-mean', 'downsample-sum')
+
+# Bucket widths in seconds, tried in turn until enough items are saved
+DOWNSAMPLE_WIDTHS = (60, 300, 3600)
 
 """class AbstractBuffer
 
 Represents the actual buffer being used.
+
+Buffers are created with (bufferName, buffer_size, path=None, buffer_bytes=0):
+the maximum number of items, the directory of the files of persistent
+buffers and the maximum size of the items in bytes, 0 for no limit. The
+oldest items are dropped beyond either limit, or downsampled depending on
+the overflow policy, see setLimits.
 """
 
 
 class AbstractBuffer:
 
+    # True if the items are kept on disk, and survive a restart
+    persistent = False
+
+    # What to do with the oldest items when full, see OVERFLOW_POLICIES
+    overflow = 'drop-oldest'
+    # Counters: items merged into buckets, and items saved by doing so
+    downsampled = 0
+    reclaimed = 0
+    _downsampling = False
+    _downsample_log_timestamp = 0
+    # Number of frames merged into each bucket, see downsample()
+    _weights = None
+    # (nodeid, number of items) of the frames ending with their rssi
+    _rssi_layouts = frozenset()
+    # Number of the items returned by the last retrieveItems still buffered,
+    # and of those dropped since as the buffer is full, eg while they are
+    # being sent and items are spilled in from the hub thread. None once
+    # discarded.
+    _in_flight = None
+    _in_flight_dropped = 0
+
     def storeItem(self, data):
         raise NotImplementedError
 
+    def storeItems(self, items):
+        for data in items:
+            self.storeItem(data)
+
     def retrieveItems(self, number):
         raise NotImplementedError
 
@@ -35,20 +104,260 @@ class AbstractBuffer:
     def hasItems(self):
         raise NotImplementedError
 
+    def commit(self):
+        """Write the items not yet written to disk, for persistent buffers."""
+        pass
+
+    def close(self):
+        """Release the files of persistent buffers, the buffer is not used
+        any longer."""
+        pass
+
+    def setLimits(self, buffer_size, buffer_bytes=0, overflow='drop-oldest'):
+        """Change the maximum number of items and size in bytes (0 for no
+        limit) of the buffer, and the overflow policy applied beyond."""
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Invalid overflow policy: " + str(overflow))
+        with self._lock:
+            self._maximumEntriesInBuffer = int(buffer_size)
+            self._maximumBytesInBuffer = int(buffer_bytes)
+            self.overflow = overflow
+            self._trim()
+
+    def _trim(self):
+        raise NotImplementedError
+
+    def _track_retrieved(self, number):
+        """Note that the number oldest items are being sent (lock held)."""
+        self._in_flight = number
+        self._in_flight_dropped = 0
+
+    def _track_dropped(self, number):
+        """Note that the number oldest items are dropped (lock held)."""
+        if self._in_flight:
+            dropped = min(number, self._in_flight)
+            self._in_flight -= dropped
+            self._in_flight_dropped += dropped
+
+    def _sent(self, number):
+        """Return the number of oldest items to discard once the number first
+        items retrieved are sent, less those dropped meanwhile (lock held)."""
+        if self._in_flight is not None:
+            number = max(0, number - self._in_flight_dropped)
+            self._in_flight = None
+            self._in_flight_dropped = 0
+        return number
+
+    def _drop(self, number):
+        """Drop the number oldest items as the buffer is full (lock held)."""
+        self._track_dropped(number)
+        self._discard(number)
+
+    def markRssi(self, nodeid, length):
+        """Note that the frames of nodeid with length items end with their
+        rssi, which is not merged when downsampling."""
+        if (nodeid, length) not in self._rssi_layouts:
+            self._rssi_layouts = self._rssi_layouts | {(nodeid, length)}
+
+    def copyDownsampling(self, other):
+        """Take over the downsampling state of the buffer other, whose items
+        are moved to this one."""
+        with self._lock:
+            self._rssi_layouts = self._rssi_layouts | other._rssi_layouts
+            if other._weights:
+                self._weights = dict(self._weights or {})
+                self._weights.update(other._weights)
+
+    def _downsample(self, number):
+        """Merge the oldest frames to save number items, if the overflow
+        policy says so (lock held).
+
+        A tenth of the buffer at least is saved at once, so that the buffer
+        is not rebuilt for each new item. The oldest items are merged into
+        the widest buckets. Return the number of items saved, those still to
+        be saved are for the caller to drop.
+
+        """
+
+        if self.overflow == 'drop-oldest' or self._downsampling or number <= 0:
+            return 0
+        size = self.size()
+        target = max(number, size // 10)
+        # Items being sent are left as they are, the oldest items are dropped
+        # when too few others are left to merge
+        in_flight, in_flight_dropped = self._in_flight, self._in_flight_dropped
+        sending = in_flight or 0
+        if size - sending < 2 * target:
+            return 0
+        # Only retrieve as many of the oldest items as needed
+        count = min(size, sending + 2 * target)
+        while True:
+            items = self.retrieveItems(count)[sending:]
+            # Buckets of the items sent are forgotten
+            timestamps = [item[0] for item in items if _is_frame(item)]
+            oldest = min(timestamps) if timestamps else 0
+            weights = {key: weight for key, weight in (self._weights or {}).items() if key[0] >= oldest}
+            merged = saved = 0
+            widths = []
+            for width in DOWNSAMPLE_WIDTHS:
+                items, frames, items_saved = downsample(items, target - saved, width, self.overflow,
+                                                        weights, self._rssi_layouts)
+                merged += frames
+                saved += items_saved
+                if items_saved:
+                    widths.append(str(width))
+                if saved >= target:
+                    break
+            if saved >= target or count >= size:
+                break
+            count = min(size, sending + 4 * (count - sending))
+        if not saved:
+            self._in_flight, self._in_flight_dropped = in_flight, in_flight_dropped
+            return 0
+        self._weights = weights
+        items = self.retrieveItems(sending) + items
+
+        self._downsampling = True
+        try:
+            self._discard(count)
+            self.storeItems(items)
+            # Move the newer items back behind the merged ones
+            rest = size - count
+            while rest > 0:
+                batch = self.retrieveItems(min(rest, 1000))
+                self._discard(len(batch))
+                self.storeItems(batch)
+                rest -= len(batch)
+        finally:
+            self._downsampling = False
+            self._in_flight, self._in_flight_dropped = in_flight, in_flight_dropped
+        self.downsampled += merged
+        self.reclaimed += saved
+        # Warn once an hour at most, a long outage merges many times
+        message = ("Buffer (%s) full, %d items merged into %d buckets of %s s (%s), %d items saved so far"
+                   % (self._bufferName, merged, merged - saved, ', '.join(widths), self.overflow, self.reclaimed))
+        now = time.time()
+        if now - self._downsample_log_timestamp >= 3600:
+            self._downsample_log_timestamp = now
+            self._log.warning(message)
+        else:
+            self._log.info(message)
+        return saved
+
+
+def _is_frame(item):
+    """True for [timestamp, nodeid, values...] with numerical values only."""
+    if type(item) is not list or len(item) < 3 or type(item[1]) is not int:
+        return False
+    for value in item:
+        if type(value) is not float and type(value) is not int:
+            return False
+    return True
+
+
+def downsample(items, number, width, policy, weights=None, rssi_layouts=()):
+    """Merge the oldest frames until number items are saved.
+
+    Frames from the same node and with as many values whose timestamps fall
+    in the same bucket of width seconds are merged into one, timestamped at
+    the start of the bucket, holding the mean of their values, or the sum
+    with the 'downsample-sum' policy. It takes the place of the first of
+    them, other items are left as they are.
+
+    weights (dict): number of frames merged into each bucket by previous
+    calls, by (timestamp, nodeid, number of items), so that means of means
+    are weighted. Updated with the buckets merged by this call.
+    rssi_layouts: (nodeid, number of items) of the frames ending with their
+    rssi, the rssi of the first frame of a bucket is kept
+
+    Return (items, number of frames merged, number of items saved).
+
+    """
+
+    if weights is None:
+        weights = {}
+    mean = policy == 'downsample-mean'
+    result = []
+    # [row in result, number of frames, number of items] of each bucket, by
+    # (start, nodeid, number of items)
+    buckets = {}
+    saved = 0
+    consumed = 0
+    for item in items:
+        if saved >= number:
+            break
+        consumed += 1
+        if not _is_frame(item):
+            result.append(item)
+            continue
+        start = item[0] - item[0] % width
+        key = (start, item[1], len(item))
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [len(result), weights.get((item[0], item[1], len(item)), 1), 1]
+            result.append(item)
+            continue
+        end = len(item) - 1 if (item[1], len(item)) in rssi_layouts else len(item)
+        row = result[bucket[0]]
+        if bucket[2] == 1:
+            # the first item itself, copied before merging into it
+            weights.pop((row[0], row[1], len(row)), None)
+            row = result[bucket[0]] = list(row)
+            row[0] = start
+            if mean:
+                for i in range(2, end):
+                    row[i] *= bucket[1]
+        weight = weights.pop((item[0], item[1], len(item)), 1)
+        for i in range(2, end):
+            row[i] += item[i] * weight if mean else item[i]
+        bucket[1] += weight
+        bucket[2] += 1
+        saved += 1
+
+    merged = 0
+    for key, (index, frames, count) in buckets.items():
+        if count > 1:
+            merged += count
+            row = result[index]
+            weights[key] = frames
+            if mean:
+                end = len(row) - 1 if (row[1], len(row)) in rssi_layouts else len(row)
+                for i in range(2, end):
+                    row[i] /= frames
+    result.extend(itertools.islice(items, consumed, None))
+    return result, merged, saved
+
+
+def _item_bytes(item):
+    """Estimated memory used by a buffered item, eg [timestamp, nodeid, values...]."""
+    size = sys.getsizeof(item)
+    if isinstance(item, (list, tuple)):
+        size += sum(map(sys.getsizeof, item))
+    return size
+
 """
 This implementation of the AbstractBuffer just uses an in-memory data structure.
 It's basically identical to the previous (inline) buffer.
+
+Items are held in a deque: storing, and discarding the oldest items once they
+are sent or the buffer is full, don't copy the rest of the buffer, so that a
+large buffer is flushed in linear time.
 """
 
 
 class InMemoryBuffer(AbstractBuffer):
 
-    def __init__(self, bufferName, buffer_size):
+    def __init__(self, bufferName, buffer_size, path=None, buffer_bytes=0):
         self._bufferName = str(bufferName)
         self._buffer_type = "memory"
         self._maximumEntriesInBuffer = int(buffer_size)
-        self._data_buffer = []
+        self._maximumBytesInBuffer = int(buffer_bytes)
+        self._data_buffer = collections.deque()
+        # Estimated memory used by the items, only counted with a byte limit
+        self._bytes = 0
         self._log = logging.getLogger("EmonHub")
+        # Items may be spilled in from the hub thread, see EmonHubChannel
+        self._lock = threading.RLock()
 
     def hasItems(self):
         return self.size() > 0
@@ -57,13 +366,16 @@ class InMemoryBuffer(AbstractBuffer):
         return self.size() >= self._maximumEntriesInBuffer
 
     def getMaxEntrySliceIndex(self):
+        """Number of oldest items to discard to make room for a new one."""
         return max(0,
-                   self.size() - self._maximumEntriesInBuffer - 1)
+                   self.size() - self._maximumEntriesInBuffer + 1)
 
     def discardOldestItems(self):
-        self._data_buffer = self._data_buffer[self.getMaxEntrySliceIndex():]
+        self._drop(self.getMaxEntrySliceIndex())
 
     def discardOldestItemsIfFull(self):
+        if self.isFull() and self._downsample(self.getMaxEntrySliceIndex()) and not self.isFull():
+            return
         if self.isFull():
             self._log.warning(
                 "In-memory buffer (%s) reached limit of %d items, deleting oldest"
@@ -71,37 +383,1130 @@ class InMemoryBuffer(AbstractBuffer):
         self.discardOldestItems()
 
     def storeItem(self, data):
-        self.discardOldestItemsIfFull()
-        self._data_buffer.append(data)
+        with self._lock:
+            self.discardOldestItemsIfFull()
+            self._data_buffer.append(data)
+            if self._maximumBytesInBuffer:
+                self._bytes += _item_bytes(data)
+                self._trimBytes()
+
+    def storeItems(self, items):
+        with self._lock:
+            items = list(items)
+            self._data_buffer.extend(items)
+            if self._maximumBytesInBuffer:
+                self._bytes += sum(map(_item_bytes, items))
+            self._trim()
+
+    def setLimits(self, buffer_size, buffer_bytes=0, overflow='drop-oldest'):
+        with self._lock:
+            if int(buffer_bytes) and not self._maximumBytesInBuffer:
+                self._bytes = sum(map(_item_bytes, self._data_buffer))
+            super().setLimits(buffer_size, buffer_bytes, overflow)
+
+    def _trim(self):
+        self._downsample(self.size() - self._maximumEntriesInBuffer)
+        if self.size() > self._maximumEntriesInBuffer:
+            self._log.warning(
+                "In-memory buffer (%s) reached limit of %d items, deleting oldest"
+                % (self._bufferName, self._maximumEntriesInBuffer))
+            self._drop(self.size() - self._maximumEntriesInBuffer)
+        self._trimBytes()
+
+    def _trimBytes(self):
+        if self._maximumBytesInBuffer and self._bytes > self._maximumBytesInBuffer:
+            # Number of average items over the limit
+            excess = self._bytes - self._maximumBytesInBuffer
+            self._downsample(excess * self.size() // self._bytes + 1)
+        if self._maximumBytesInBuffer and self._bytes > self._maximumBytesInBuffer:
+            self._log.warning(
+                "In-memory buffer (%s) reached limit of %d bytes, deleting oldest"
+                % (self._bufferName, self._maximumBytesInBuffer))
+            while self._data_buffer and self._bytes > self._maximumBytesInBuffer:
+                self._bytes -= _item_bytes(self._data_buffer.popleft())
+                self._track_dropped(1)
 
     def retrieveItem(self):
-        return self._data_buffer[0]
+        with self._lock:
+            self._track_retrieved(1)
+            return self._data_buffer[0]
 
     def retrieveItems(self, number):
-        blen = len(self._data_buffer)
-        if number > blen:
-            number = blen
-        return self._data_buffer[:number]
+        with self._lock:
+            items = list(itertools.islice(self._data_buffer, max(0, number)))
+            self._track_retrieved(len(items))
+            return items
 
     def discardLastRetrievedItem(self):
-        del self._data_buffer[0]
+        self.discardLastRetrievedItems(1)
 
     def discardLastRetrievedItems(self, number):
-        blen = len(self._data_buffer)
-        if number > blen:
-            number = blen
-        self._data_buffer = self._data_buffer[number:]
+        with self._lock:
+            self._discard(self._sent(number))
+
+    def _discard(self, number):
+        """Discard the number oldest items, or all if there are fewer."""
+        if number >= self.size():
+            self._data_buffer.clear()
+            self._bytes = 0
+        elif self._maximumBytesInBuffer:
+            for _ in range(number):
+                self._bytes -= _item_bytes(self._data_buffer.popleft())
+        else:
+            popleft = self._data_buffer.popleft
+            for _ in range(number):
+                popleft()
 
     def size(self):
         return len(self._data_buffer)
 
 
+"""class CompactBuffer
+
+In-memory buffer for numerical items, eg [timestamp, nodeid, values...],
+held as packed doubles rather than lists of Python floats and ints: a few
+times less memory for a large backlog.
+
+Items with the same layout, the type of each of their values, are packed
+one after the other in the array('d') of the layout, and the layout of each
+item is kept in order. Lists are only built for the items retrieved, ints
+are read back as ints. Other items, eg with strings or ints too large to be
+held exactly by a double, are kept as they are.
+
+"""
+
+
+class _CompactLayout:
+
+    __slots__ = ('width', 'ints', 'values', 'head')
+
+    def __init__(self, types):
+        self.width = len(types)
+        # Positions of the int values
+        self.ints = tuple(i for i, t in enumerate(types) if t is int)
+        self.values = array('d')
+        # Offset of the values of the oldest item
+        self.head = 0
+
+
+class CompactBuffer(AbstractBuffer):
+
+    # Largest int held exactly by a double
+    INT_MAX = 2**53
+    # The discarded start of an array is deleted once that many values long
+    # and half of the array
+    COMPACT_MIN = 4096
+
+    def __init__(self, bufferName, buffer_size, path=None, buffer_bytes=0):
+        self._bufferName = str(bufferName)
+        self._buffer_type = "compact"
+        self._maximumEntriesInBuffer = int(buffer_size)
+        self._maximumBytesInBuffer = int(buffer_bytes)
+        self._log = logging.getLogger("EmonHub")
+        # Items may be spilled in from the hub thread, see EmonHubChannel
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        # _CompactLayout by id, 0 for the items kept as they are
+        self._layouts = [None]
+        self._index = {}
+        self._others = collections.deque()
+        # Layout id of each item, oldest first from _head
+        self._order = array('H')
+        self._head = 0
+        # Estimated memory used by the items
+        self._bytes = 0
+
+    def _layout_id(self, data):
+        if type(data) is not list:
+            return 0
+        types = tuple(map(type, data))
+        layout_id = self._index.get(types)
+        if layout_id is None:
+            if not all(t is int or t is float for t in types) or len(self._layouts) > 0xffff:
+                return 0
+            layout_id = self._index[types] = len(self._layouts)
+            self._layouts.append(_CompactLayout(types))
+        for i in self._layouts[layout_id].ints:
+            if not -self.INT_MAX <= data[i] <= self.INT_MAX:
+                return 0
+        return layout_id
+
+    def _add(self, data):
+        layout_id = self._layout_id(data)
+        if layout_id:
+            self._layouts[layout_id].values.extend(data)
+            self._bytes += 2 + 8 * len(data)
+        else:
+            self._others.append(data)
+            self._bytes += 2 + _item_bytes(data)
+        self._order.append(layout_id)
+
+    def storeItem(self, data):
+        with self._lock:
+            self._add(data)
+            self._trim()
+
+    def storeItems(self, items):
+        with self._lock:
+            for data in items:
+                self._add(data)
+            self._trim()
+
+    def _trim(self):
+        excess = self.size() - self._maximumEntriesInBuffer
+        excess -= self._downsample(excess)
+        if excess > 0:
+            self._log.warning(
+                "Compact buffer (%s) reached limit of %d items, deleting oldest"
+                % (self._bufferName, self._maximumEntriesInBuffer))
+            self._drop(excess)
+        if self._maximumBytesInBuffer and self._bytes > self._maximumBytesInBuffer:
+            excess = self._bytes - self._maximumBytesInBuffer
+            self._downsample(excess * self.size() // self._bytes + 1)
+        if self._maximumBytesInBuffer and self._bytes > self._maximumBytesInBuffer:
+            self._log.warning(
+                "Compact buffer (%s) reached limit of %d bytes, deleting oldest"
+                % (self._bufferName, self._maximumBytesInBuffer))
+            excess_bytes = self._bytes - self._maximumBytesInBuffer
+            number = 0
+            others = iter(self._others)
+            for layout_id in self._order[self._head:]:
+                if layout_id:
+                    excess_bytes -= 2 + 8 * self._layouts[layout_id].width
+                else:
+                    excess_bytes -= 2 + _item_bytes(next(others))
+                number += 1
+                if excess_bytes <= 0:
+                    break
+            self._drop(number)
+
+    def retrieveItem(self):
+        return self.retrieveItems(1)[0]
+
+    def retrieveItems(self, number):
+        with self._lock:
+            items = []
+            offsets = {}
+            others = iter(self._others)
+            for layout_id in self._order[self._head:self._head + max(0, number)]:
+                if not layout_id:
+                    items.append(next(others))
+                    continue
+                layout = self._layouts[layout_id]
+                offset = offsets.get(layout_id, layout.head)
+                offsets[layout_id] = offset + layout.width
+                item = layout.values[offset:offset + layout.width].tolist()
+                for i in layout.ints:
+                    item[i] = int(item[i])
+                items.append(item)
+            self._track_retrieved(len(items))
+            return items
+
+    def discardLastRetrievedItem(self):
+        self.discardLastRetrievedItems(1)
+
+    def discardLastRetrievedItems(self, number):
+        with self._lock:
+            self._discard(self._sent(number))
+
+    def _discard(self, number):
+        """Discard the number oldest items, or all if there are fewer."""
+
+        if number >= self.size():
+            self._reset()
+            return
+        if number <= 0:
+            return
+        counts = collections.Counter(self._order[self._head:self._head + number])
+        self._head += number
+        for layout_id, count in counts.items():
+            if not layout_id:
+                for _ in range(count):
+                    self._bytes -= 2 + _item_bytes(self._others.popleft())
+                continue
+            layout = self._layouts[layout_id]
+            layout.head += count * layout.width
+            self._bytes -= count * (2 + 8 * layout.width)
+            if layout.head >= self.COMPACT_MIN and 2 * layout.head >= len(layout.values):
+                del layout.values[:layout.head]
+                layout.head = 0
+        if self._head >= self.COMPACT_MIN and 2 * self._head >= len(self._order):
+            del self._order[:self._head]
+            self._head = 0
+
+    def hasItems(self):
+        return self.size() > 0
+
+    def size(self):
+        return len(self._order) - self._head
+
+    def sizeBytes(self):
+        """Estimated memory used by the items."""
+        return self._bytes
+
+
+"""class TieredBuffer
+
+Buffer for long outages: the recent items are kept as they are (the hot
+tier), older ones are compressed by chunks of CHUNK_ITEMS items (the cold
+tier), so that days of backlog take a few MB. Chunks are decompressed one
+at a time, oldest first, as the items are sent.
+
+In a chunk, frames ([timestamp, nodeid, values...]) are delta encoded: the
+timestamp as the difference of its bits with the previous one and the node
+id as the difference with the previous one, mostly 0. The chunk is then
+compressed with COMPRESSION, 'zlib' or 'lzma'.
+
+Chunks are kept in memory, or on disk if path is given, in the
+<bufferName>.buffer.cold directory of path: the buffer is then persistent,
+the hot tier being written as a chunk on commit, eg on exit. A chunk is
+deleted once all its items are sent, those of a chunk partly sent when
+emonhub stops are sent again after the restart.
+
+bufferName (string): name of the buffer
+buffer_size (int): maximum number of items, the oldest are dropped beyond
+path (string): directory of the cold tier, None to keep it in memory
+buffer_bytes (int): maximum size of the items, estimated memory for the hot
+tier and compressed size for the cold tier, 0 for no limit
+
+"""
+
+
+# Bits of a double as an int, and back, to delta encode timestamps exactly
+_DOUBLE = struct.Struct('<d')
+_INT64 = struct.Struct('<q')
+
+
+def _double_bits(value):
+    return _INT64.unpack(_DOUBLE.pack(value))[0]
+
+
+def _bits_double(bits):
+    return _DOUBLE.unpack(_INT64.pack(bits))[0]
+
+
+class TieredBuffer(AbstractBuffer):
+
+    CHUNK_ITEMS = 1000
+    COMPRESSION = 'zlib'
+
+    def __init__(self, bufferName, buffer_size, path=None, buffer_bytes=0):
+        self._bufferName = str(bufferName)
+        self._buffer_type = "tiered"
+        self._maximumEntriesInBuffer = int(buffer_size)
+        self._maximumBytesInBuffer = int(buffer_bytes)
+        self._log = logging.getLogger("EmonHub")
+        # Items may be spilled in from the hub thread, see EmonHubChannel
+        self._lock = threading.RLock()
+
+        # Newest items, oldest first
+        self._hot = collections.deque()
+        # Compressed chunks, oldest first, as [number of items, data or file]
+        self._cold = collections.deque()
+        # Items of the oldest chunks, decompressed to be sent, and for each
+        # chunk [number of items left, file or None]
+        self._head = collections.deque()
+        self._head_chunks = collections.deque()
+        # Number of items in the cold tier, estimated or compressed size of
+        # each tier
+        self._cold_count = 0
+        self._bytes = {'hot': 0, 'cold': 0, 'head': 0}
+
+        self._dir = None
+        self._seq = 0
+        self.persistent = path is not None
+        if path is not None:
+            self._dir = os.path.join(path, self._bufferName + ".buffer.cold")
+            os.makedirs(self._dir, exist_ok=True)
+            self._load()
+
+    def _load(self):
+        """Pick up the chunks left on disk by the previous run."""
+
+        chunks = []
+        for name in os.listdir(self._dir):
+            if name.endswith(".tmp"):
+                # chunk left half written
+                os.remove(os.path.join(self._dir, name))
+                continue
+            seq, _, count = name[:-6].partition('-')
+            if name.endswith(".chunk") and seq.isdigit() and count.isdigit():
+                chunks.append((int(seq), int(count), os.path.join(self._dir, name)))
+        for seq, count, filename in sorted(chunks):
+            self._cold.append([count, filename])
+            self._cold_count += count
+            self._bytes['cold'] += os.path.getsize(filename)
+            self._seq = seq + 1
+        if self._cold_count:
+            self._log.info("%s: %d buffered items in %s" % (self._bufferName, self._cold_count, self._dir))
+
+    def storeItem(self, data):
+        with self._lock:
+            self._hot.append(data)
+            self._bytes['hot'] += _item_bytes(data)
+            self._store()
+
+    def storeItems(self, items):
+        with self._lock:
+            for data in items:
+                self._hot.append(data)
+                self._bytes['hot'] += _item_bytes(data)
+            self._store()
+
+    def _store(self):
+        # Older items go cold, the newest CHUNK_ITEMS at least are kept hot
+        while len(self._hot) >= 2 * self.CHUNK_ITEMS:
+            self._freeze(self.CHUNK_ITEMS)
+        self._trim()
+
+    def _freeze(self, number):
+        """Move the number oldest hot items to a new chunk."""
+
+        items = [self._hot.popleft() for _ in range(number)]
+        self._bytes['hot'] -= sum(map(_item_bytes, items))
+        data = self._encode(items)
+        if self._dir is not None:
+            filename = os.path.join(self._dir, "%08d-%d.chunk" % (self._seq, len(items)))
+            self._seq += 1
+            try:
+                with open(filename + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(filename + ".tmp", filename)
+            except OSError as e:
+                self._log.error("%s: unable to write buffered items to %s: %s" % (self._bufferName, filename, e))
+            else:
+                data = filename
+        self._cold.append([len(items), data])
+        self._cold_count += len(items)
+        self._bytes['cold'] += self._chunk_size(data)
+
+    def _chunk_size(self, data):
+        if isinstance(data, bytes):
+            return len(data)
+        try:
+            return os.path.getsize(data)
+        except OSError:
+            return 0
+
+    def _encode(self, items):
+        """Return a chunk of items, delta encoded and compressed."""
+
+        kinds = []
+        frames = []
+        others = []
+        timestamp = node = 0
+        for item in items:
+            if type(item) is list and len(item) >= 2 and type(item[0]) is float and type(item[1]) is int:
+                bits = _double_bits(item[0])
+                frames.append([bits - timestamp, item[1] - node] + item[2:])
+                timestamp, node = bits, item[1]
+                kinds.append('f')
+            else:
+                others.append(item)
+                kinds.append('o')
+        data = json.dumps([''.join(kinds), frames, others], separators=(',', ':')).encode()
+        if self.COMPRESSION == 'lzma' and lzma_found:
+            return b'x' + lzma.compress(data)
+        return b'z' + zlib.compress(data)
+
+    def _decode(self, data):
+        """Return the items of a chunk."""
+
+        if data[:1] == b'x':
+            data = lzma.decompress(data[1:])
+        else:
+            data = zlib.decompress(data[1:])
+        kinds, frames, others = json.loads(data)
+        frames = iter(frames)
+        others = iter(others)
+        items = []
+        timestamp = node = 0
+        for kind in kinds:
+            if kind == 'f':
+                frame = next(frames)
+                timestamp += frame[0]
+                node += frame[1]
+                frame[0] = _bits_double(timestamp)
+                frame[1] = node
+                items.append(frame)
+            else:
+                items.append(next(others))
+        return items
+
+    def _thaw(self):
+        """Decompress the oldest chunk into the head, return False if none."""
+
+        if not self._cold:
+            return False
+        count, data = self._cold.popleft()
+        self._cold_count -= count
+        self._bytes['cold'] -= self._chunk_size(data)
+        filename = None
+        if not isinstance(data, bytes):
+            filename = data
+            try:
+                with open(filename, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                self._log.error("%s: unable to read buffered items from %s: %s" % (self._bufferName, filename, e))
+                return True
+        try:
+            items = self._decode(data)
+        except (ValueError, TypeError, StopIteration, zlib.error) as e:
+            self._log.error("%s: discarded %d invalid buffered items: %s" % (self._bufferName, count, e))
+            self._remove(filename)
+            return True
+        self._head.extend(items)
+        self._head_chunks.append([len(items), filename])
+        self._bytes['head'] += sum(map(_item_bytes, items))
+        return True
+
+    def _remove(self, filename):
+        if filename is not None:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def _trim(self):
+        excess = self.size() - self._maximumEntriesInBuffer
+        if excess > 0:
+            self._log.warning(
+                "Tiered buffer (%s) reached limit of %d items, deleting oldest"
+                % (self._bufferName, self._maximumEntriesInBuffer))
+            self._drop(excess)
+        if self._maximumBytesInBuffer and self.sizeBytes() > self._maximumBytesInBuffer:
+            self._log.warning(
+                "Tiered buffer (%s) reached limit of %d bytes, deleting oldest"
+                % (self._bufferName, self._maximumBytesInBuffer))
+            while self.hasItems() and self.sizeBytes() > self._maximumBytesInBuffer:
+                if not self._head and self._cold:
+                    # whole chunks go at once
+                    count, data = self._cold.popleft()
+                    self._cold_count -= count
+                    self._bytes['cold'] -= self._chunk_size(data)
+                    self._remove(None if isinstance(data, bytes) else data)
+                    self._track_dropped(count)
+                else:
+                    self._drop(1)
+
+    def commit(self):
+        with self._lock:
+            if self.persistent and self._hot:
+                self._freeze(len(self._hot))
+
+    def close(self):
+        self.commit()
+
+    def retrieveItem(self):
+        return self.retrieveItems(1)[0]
+
+    def retrieveItems(self, number):
+        with self._lock:
+            while len(self._head) < number and self._thaw():
+                pass
+            items = list(itertools.islice(self._head, max(0, number)))
+            if len(items) < number:
+                items.extend(itertools.islice(self._hot, number - len(items)))
+            self._track_retrieved(len(items))
+            return items
+
+    def discardLastRetrievedItem(self):
+        self.discardLastRetrievedItems(1)
+
+    def discardLastRetrievedItems(self, number):
+        with self._lock:
+            self._discard(self._sent(number))
+
+    def _discard(self, number):
+        """Discard the number oldest items, or all if there are fewer."""
+
+        while number > 0 and (self._head or self._thaw()):
+            while number > 0 and self._head:
+                self._bytes['head'] -= _item_bytes(self._head.popleft())
+                number -= 1
+                chunk = self._head_chunks[0]
+                chunk[0] -= 1
+                if not chunk[0]:
+                    self._head_chunks.popleft()
+                    self._remove(chunk[1])
+        for _ in range(min(number, len(self._hot))):
+            self._bytes['hot'] -= _item_bytes(self._hot.popleft())
+
+    def hasItems(self):
+        return self.size() > 0
+
+    def size(self):
+        return len(self._head) + self._cold_count + len(self._hot)
+
+    def sizeBytes(self):
+        """Estimated memory used by the items, and size of the chunks."""
+        return self._bytes['hot'] + self._bytes['cold'] + self._bytes['head']
+
+
+"""class SQLiteBuffer
+
+Persistent buffer: items are kept in a SQLite database, so that they are
+sent after a restart, a crash or a power cut, and a long outage doesn't
+fill the RAM.
+
+The database is in WAL mode and is only synced to disk at checkpoints.
+Items are written in batches: new items are kept in memory and written in
+a single transaction when COMMIT_ITEMS of them are pending or COMMIT_INTERVAL
+seconds after the previous write. Sent items are deleted in one transaction
+per batch. The SD card is therefore written to a few times a minute at most,
+whatever the frame rate, and at worst the last COMMIT_INTERVAL seconds of
+data are lost on a power cut.
+
+bufferName (string): name of the database file, <bufferName>.buffer.sqlite
+buffer_size (int): maximum number of items, the oldest are dropped beyond
+path (string): directory of the database file, DEFAULT_PATH if None
+buffer_bytes (int): maximum size of the items as stored, 0 for no limit
+
+Items are stored as JSON, like the items saved on exit, see
+EmonHubInterfacer.persist.
+
+"""
+
+
+class SQLiteBuffer(AbstractBuffer):
+
+    persistent = True
+
+    COMMIT_ITEMS = 500
+    COMMIT_INTERVAL = 10
+
+    def __init__(self, bufferName, buffer_size, path=None, buffer_bytes=0):
+        self._bufferName = str(bufferName)
+        self._buffer_type = "sqlite"
+        self._maximumEntriesInBuffer = int(buffer_size)
+        self._maximumBytesInBuffer = int(buffer_bytes)
+        self._log = logging.getLogger("EmonHub")
+        # Items may be spilled in from the hub thread, see EmonHubChannel
+        self._lock = threading.RLock()
+
+        if not sqlite3_found:
+            raise RuntimeError("sqlite3 module not available")
+        path = path or DEFAULT_PATH
+        os.makedirs(path, exist_ok=True)
+        self._filename = os.path.join(path, self._bufferName + ".buffer.sqlite")
+        self._db = sqlite3.connect(self._filename, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS buffer (id INTEGER PRIMARY KEY AUTOINCREMENT, item TEXT NOT NULL)")
+        # Number and size of the items in the database
+        self._count, self._bytes = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(item)), 0) FROM buffer").fetchone()
+
+        # Items not written yet, as JSON
+        self._pending = collections.deque()
+        self._pending_bytes = 0
+        self._last_commit = time.time()
+        # Number and size of the oldest items of the database to delete at
+        # the next write, dropped as the buffer is full: those up to
+        # _dropped_id
+        self._dropped = 0
+        self._dropped_bytes = 0
+        self._dropped_id = 0
+        # Id of each item returned by the last retrieveItems, 0 once
+        # dropped from the pending ones, then number of those still pending;
+        # None if discarded since
+        self._retrieved = None
+        self._retrieved_pending = 0
+
+        if self._count:
+            self._log.info("%s: %d buffered items in %s" % (self._bufferName, self._count, self._filename))
+
+    def storeItem(self, data):
+        with self._lock:
+            self._add(data)
+            self._store()
+
+    def storeItems(self, items):
+        with self._lock:
+            for data in items:
+                self._add(data)
+            self._store()
+
+    def _add(self, data):
+        item = json.dumps(data, separators=(',', ':'))
+        self._pending.append(item)
+        self._pending_bytes += len(item)
+
+    def _store(self):
+        self._trim()
+        if len(self._pending) >= self.COMMIT_ITEMS or time.time() - self._last_commit >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def _trim(self):
+        excess = self.size() - self._maximumEntriesInBuffer
+        excess_bytes = self.sizeBytes() - self._maximumBytesInBuffer if self._maximumBytesInBuffer else 0
+        if excess <= 0 and excess_bytes <= 0:
+            return
+        if excess > 0:
+            self._log.warning(
+                "SQLite buffer (%s) reached limit of %d items, deleting oldest"
+                % (self._bufferName, self._maximumEntriesInBuffer))
+        else:
+            self._log.warning(
+                "SQLite buffer (%s) reached limit of %d bytes, deleting oldest"
+                % (self._bufferName, self._maximumBytesInBuffer))
+
+        # Items retrieved and dropped before being discarded are deleted
+        # with the others, see _discard
+        if self._count > self._dropped:
+            rows = self._db.execute("SELECT id, LENGTH(item) FROM buffer WHERE id > ? ORDER BY id", (self._dropped_id,))
+            for item_id, length in rows:
+                if excess <= 0 and excess_bytes <= 0:
+                    break
+                self._dropped += 1
+                self._dropped_bytes += length
+                self._dropped_id = item_id
+                excess -= 1
+                excess_bytes -= length
+            rows.close()
+        while self._pending and (excess > 0 or excess_bytes > 0):
+            length = len(self._pending.popleft())
+            self._pending_bytes -= length
+            if self._retrieved is not None and self._retrieved_pending:
+                self._retrieved.append(0)
+                self._retrieved_pending -= 1
+            excess -= 1
+            excess_bytes -= length
+
+    def commit(self):
+        with self._lock:
+            self._last_commit = time.time()
+            if not self._pending and not self._dropped:
+                return
+            rows = [(item,) for item in self._pending]
+            try:
+                with self._db:
+                    self._db.execute("BEGIN")
+                    if self._dropped:
+                        self._db.execute("DELETE FROM buffer WHERE id <= ?", (self._dropped_id,))
+                    self._db.executemany("INSERT INTO buffer (item) VALUES (?)", rows)
+                    # Pending items retrieved are now rows, the first ones inserted
+                    retrieved = []
+                    if self._retrieved is not None and self._retrieved_pending and rows:
+                        retrieved = self._db.execute(
+                            "SELECT id FROM (SELECT id FROM buffer ORDER BY id DESC LIMIT ?) ORDER BY id LIMIT ?",
+                            (len(rows), self._retrieved_pending)).fetchall()
+            except sqlite3.Error as e:
+                self._log.error("%s: unable to write %d buffered items to %s: %s"
+                                % (self._bufferName, len(rows), self._filename, e))
+                return
+            self._count += len(rows) - self._dropped
+            self._bytes += self._pending_bytes - self._dropped_bytes
+            self._dropped = self._dropped_bytes = 0
+            if retrieved:
+                self._retrieved.extend(item_id for (item_id,) in retrieved)
+            self._retrieved_pending = 0
+            self._pending.clear()
+            self._pending_bytes = 0
+
+    def retrieveItem(self):
+        return self.retrieveItems(1)[0]
+
+    def retrieveItems(self, number):
+        with self._lock:
+            if time.time() - self._last_commit >= self.COMMIT_INTERVAL:
+                self.commit()
+            items = []
+            self._retrieved = []
+            if self._count > self._dropped and number > 0:
+                for item_id, item in self._db.execute(
+                        "SELECT id, item FROM buffer WHERE id > ? ORDER BY id LIMIT ?", (self._dropped_id, number)):
+                    self._retrieved.append(item_id)
+                    items.append(json.loads(item))
+            pending = [json.loads(item) for item in itertools.islice(self._pending, max(0, number - len(items)))]
+            self._retrieved_pending = len(pending)
+            return items + pending
+
+    def discardLastRetrievedItem(self):
+        self.discardLastRetrievedItems(1)
+
+    def discardLastRetrievedItems(self, number):
+        with self._lock:
+            self._discard(number)
+
+    def _discard(self, number):
+        """Discard the number oldest items, or all if there are fewer.
+
+        After retrieveItems, those are the items retrieved, even if some were
+        dropped or written to the database in the meantime.
+
+        """
+
+        number = max(0, number)
+        if self._retrieved is not None:
+            sent = self._retrieved[:number]
+            last_id = max(sent, default=0)
+            pending = min(number - len(sent), self._retrieved_pending)
+        else:
+            stored = min(number, self._count - self._dropped)
+            last_id = 0
+            if stored:
+                last_id = self._db.execute("SELECT id FROM buffer WHERE id > ? ORDER BY id LIMIT 1 OFFSET ?",
+                                           (self._dropped_id, stored - 1)).fetchone()[0]
+            pending = number - stored
+        last_id = max(last_id, self._dropped_id)
+
+        if last_id and (self._dropped or last_id > self._dropped_id):
+            try:
+                with self._db:
+                    self._db.execute("BEGIN")
+                    count, size = self._db.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(LENGTH(item)), 0) FROM buffer WHERE id <= ?",
+                        (last_id,)).fetchone()
+                    self._db.execute("DELETE FROM buffer WHERE id <= ?", (last_id,))
+            except sqlite3.Error as e:
+                self._log.error("%s: unable to delete buffered items from %s: %s" % (self._bufferName, self._filename, e))
+                return
+            self._count -= count
+            self._bytes -= size
+            self._dropped = self._dropped_bytes = 0
+            self._dropped_id = last_id
+        self._retrieved = None
+        self._retrieved_pending = 0
+        for _ in range(min(pending, len(self._pending))):
+            self._pending_bytes -= len(self._pending.popleft())
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            self._db.close()
+
+    def hasItems(self):
+        return self.size() > 0
+
+    def size(self):
+        return self._count - self._dropped + len(self._pending)
+
+    def sizeBytes(self):
+        """Size of the items as stored."""
+        return self._bytes - self._dropped_bytes + self._pending_bytes
+
+
+"""class MmapBuffer
+
+Persistent buffer lighter than SQLiteBuffer: a log of items appended to
+segment files of SEGMENT_SIZE bytes, accessed through mmap, with a small
+checkpoint file recording where the oldest item not yet sent is.
+
+Each item is a record: its length as 4 bytes, then the item as JSON.
+Storing an item is a copy into the mapped segment, retrieving items only
+decodes the records retrieved. Segments whose items have all been sent are
+reused for new items.
+
+Segments are written to disk by the kernel, and by commit() on exit: at
+worst the items stored in the last few seconds (the kernel writeback delay)
+are lost on a power cut. The checkpoint is written when sent items are
+discarded.
+
+bufferName (string): name of the directory of the segment files,
+<bufferName>.buffer.mmap
+buffer_size (int): maximum number of items, the oldest are dropped beyond
+path (string): directory of the segments directory, DEFAULT_PATH if None
+buffer_bytes (int): maximum size of the records, 0 for no limit
+
+"""
+
+
+class MmapBuffer(AbstractBuffer):
+
+    persistent = True
+
+    SEGMENT_SIZE = 1 << 20
+    # Consumed segments kept to be reused, the others are deleted
+    FREE_SEGMENTS = 2
+
+    _LENGTH = struct.Struct('<I')
+    # segment number and offset of the oldest item
+    _CHECKPOINT = struct.Struct('<QQ')
+
+    def __init__(self, bufferName, buffer_size, path=None, buffer_bytes=0):
+        self._bufferName = str(bufferName)
+        self._buffer_type = "mmap"
+        self._maximumEntriesInBuffer = int(buffer_size)
+        self._maximumBytesInBuffer = int(buffer_bytes)
+        self._log = logging.getLogger("EmonHub")
+        # Items may be spilled in from the hub thread, see EmonHubChannel
+        self._lock = threading.RLock()
+
+        self._dir = os.path.join(path or DEFAULT_PATH, self._bufferName + ".buffer.mmap")
+        os.makedirs(self._dir, exist_ok=True)
+        self._checkpoint_file = os.path.join(self._dir, "checkpoint")
+
+        # mmap of the segments holding items, by number, and consumed ones
+        self._segments = {}
+        self._free = []
+        # Position of the oldest item, and where the next one is written
+        self._read = (0, 0)
+        self._write = (0, 0)
+        self._count = 0
+        self._bytes = 0
+        # Position after, and size of, each item returned by the last retrieveItems
+        self._retrieved = []
+        # Segments written to since the last commit
+        self._dirty = set()
+
+        self._load()
+        if self._count:
+            self._log.info("%s: %d buffered items in %s" % (self._bufferName, self._count, self._dir))
+
+    def _segment_file(self, seq):
+        return os.path.join(self._dir, "%08d.seg" % seq)
+
+    def _load(self):
+        """Open the segments and find the items left by the previous run."""
+
+        seqs = sorted(int(f[:-4]) for f in os.listdir(self._dir) if f.endswith(".seg") and f[:-4].isdigit())
+        try:
+            with open(self._checkpoint_file, "rb") as f:
+                read = self._CHECKPOINT.unpack(f.read(self._CHECKPOINT.size))
+        except (OSError, struct.error):
+            read = (seqs[0], 0) if seqs else (0, 0)
+        if seqs and read[0] not in seqs:
+            # the checkpoint was not written before the segment was reused
+            later = [seq for seq in seqs if seq > read[0]]
+            read = (later[0], 0) if later else (read[0], 0)
+
+        for seq in seqs:
+            if seq < read[0]:
+                self._free.append(seq)
+            else:
+                self._segments[seq] = self._map(seq)
+        if not self._segments:
+            self._segments[read[0]] = self._map(read[0], create=True)
+            read = (read[0], 0)
+        self._read = read
+
+        # The next item goes after the last record of the last segment
+        last = max(self._segments)
+        self._write = (last, self._end_of(last, read[1] if read[0] == last else 0))
+        for seq, offset, size in self._positions(read, None):
+            self._count += 1
+            self._bytes += size
+
+    def _end_of(self, seq, offset):
+        """Offset after the last record of a segment, from offset."""
+        for position in self._scan(seq, offset):
+            offset = position
+        return offset
+
+    def _scan(self, seq, offset):
+        """Yield the offset after each record of a segment, from offset."""
+
+        mm = self._segments[seq]
+        while offset + 4 <= self.SEGMENT_SIZE:
+            length = self._LENGTH.unpack_from(mm, offset)[0]
+            if not length or offset + 4 + length > self.SEGMENT_SIZE:
+                return
+            offset += 4 + length
+            yield offset
+
+    def _map(self, seq, create=False):
+        """Return the mmap of a segment, a reused or new file if create."""
+
+        filename = self._segment_file(seq)
+        if create:
+            if self._free:
+                os.replace(self._segment_file(self._free.pop(0)), filename)
+            else:
+                with open(filename, "wb") as f:
+                    f.truncate(self.SEGMENT_SIZE)
+        with open(filename, "r+b") as f:
+            if os.fstat(f.fileno()).st_size < self.SEGMENT_SIZE:
+                f.truncate(self.SEGMENT_SIZE)
+            mm = mmap.mmap(f.fileno(), self.SEGMENT_SIZE)
+        if create:
+            # no record in a reused segment
+            mm[0:4] = bytes(4)
+        return mm
+
+    def _positions(self, position, number):
+        """Yield the position after each item from position, as segment
+        number, offset and record size, number items at most if not None."""
+
+        seq, offset = position
+        write_seq, write_offset = self._write
+        while number is None or number > 0:
+            if seq not in self._segments:
+                return
+            if (seq, offset) == (write_seq, write_offset):
+                return
+            mm = self._segments[seq]
+            length = 0
+            if offset + 4 <= self.SEGMENT_SIZE:
+                length = self._LENGTH.unpack_from(mm, offset)[0]
+            if length and offset + 4 + length <= self.SEGMENT_SIZE:
+                offset += 4 + length
+                if number is not None:
+                    number -= 1
+                yield (seq, offset, 4 + length)
+            elif seq + 1 in self._segments:
+                seq, offset = seq + 1, 0
+            else:
+                return
+
+    def storeItem(self, data):
+        with self._lock:
+            self._append(data)
+            self._trim()
+
+    def storeItems(self, items):
+        with self._lock:
+            for data in items:
+                self._append(data)
+            self._trim()
+
+    def _append(self, data):
+        payload = json.dumps(data, separators=(',', ':')).encode()
+        size = 4 + len(payload)
+        if size > self.SEGMENT_SIZE:
+            self._log.error("%s: item of %d bytes too large to be buffered" % (self._bufferName, len(payload)))
+            return
+
+        seq, offset = self._write
+        if offset + size > self.SEGMENT_SIZE:
+            seq, offset = seq + 1, 0
+            self._segments[seq] = self._map(seq, create=True)
+        mm = self._segments[seq]
+        end = offset + size
+        # The length is written last, a record is only valid once complete
+        if end + 4 <= self.SEGMENT_SIZE:
+            mm[end:end + 4] = bytes(4)
+        mm[offset + 4:end] = payload
+        self._LENGTH.pack_into(mm, offset, len(payload))
+        self._write = (seq, end)
+        self._dirty.add(seq)
+        self._count += 1
+        self._bytes += size
+
+    def _trim(self):
+        excess = self._count - self._maximumEntriesInBuffer
+        if excess > 0:
+            self._log.warning(
+                "Mmap buffer (%s) reached limit of %d items, deleting oldest"
+                % (self._bufferName, self._maximumEntriesInBuffer))
+            self._track_dropped(excess)
+            self._discard(excess, checkpoint=False)
+        excess_bytes = self._bytes - self._maximumBytesInBuffer if self._maximumBytesInBuffer else 0
+        if excess_bytes > 0:
+            self._log.warning(
+                "Mmap buffer (%s) reached limit of %d bytes, deleting oldest"
+                % (self._bufferName, self._maximumBytesInBuffer))
+            number = 0
+            for seq, offset, size in self._positions(self._read, self._count):
+                number += 1
+                excess_bytes -= size
+                if excess_bytes <= 0:
+                    break
+            self._track_dropped(number)
+            self._discard(number, checkpoint=False)
+
+    def retrieveItem(self):
+        return self.retrieveItems(1)[0]
+
+    def retrieveItems(self, number):
+        with self._lock:
+            items = []
+            self._retrieved = []
+            seq, offset = self._read
+            for position in self._positions(self._read, min(number, self._count)):
+                end = position[1]
+                start = end - position[2]
+                items.append(json.loads(self._segments[position[0]][start + 4:end]))
+                self._retrieved.append(position)
+            self._track_retrieved(len(items))
+            return items
+
+    def discardLastRetrievedItem(self):
+        self.discardLastRetrievedItems(1)
+
+    def discardLastRetrievedItems(self, number):
+        with self._lock:
+            self._discard(self._sent(number))
+
+    def _discard(self, number, checkpoint=True):
+        """Discard the number oldest items, or all if there are fewer.
+
+        The positions of the retrieved items still buffered are kept, they
+        are the oldest ones.
+
+        """
+
+        number = min(number, self._count)
+        if number <= 0:
+            return
+        if number <= len(self._retrieved):
+            positions = self._retrieved[:number]
+        else:
+            positions = list(self._positions(self._read, number))
+        self._retrieved = self._retrieved[number:]
+        self._count -= number
+        self._bytes -= sum(position[2] for position in positions)
+        self._read = self._write if not self._count else positions[-1][:2]
+
+        consumed = [seq for seq in self._segments if seq < self._read[0]]
+        for seq in sorted(consumed):
+            self._segments.pop(seq).close()
+            self._dirty.discard(seq)
+            self._free.append(seq)
+        while len(self._free) > self.FREE_SEGMENTS:
+            try:
+                os.remove(self._segment_file(self._free.pop(0)))
+            except OSError:
+                pass
+        if checkpoint or consumed:
+            self._write_checkpoint()
+
+    def _write_checkpoint(self):
+        try:
+            with open(self._checkpoint_file + ".tmp", "wb") as f:
+                f.write(self._CHECKPOINT.pack(*self._read))
+            os.replace(self._checkpoint_file + ".tmp", self._checkpoint_file)
+        except OSError as e:
+            self._log.error("%s: unable to write checkpoint %s: %s" % (self._bufferName, self._checkpoint_file, e))
+
+    def commit(self):
+        with self._lock:
+            for seq in self._dirty:
+                self._segments[seq].flush()
+            self._dirty.clear()
+            self._write_checkpoint()
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            for mm in self._segments.values():
+                mm.close()
+            self._segments = {}
+
+    def hasItems(self):
+        return self.size() > 0
+
+    def size(self):
+        return self._count
+
+    def sizeBytes(self):
+        """Size of the records."""
+        return self._bytes
+
+
 """
 The getBuffer function returns the buffer class corresponding to a
 buffering method passed as argument.
 """
 bufferMethodMap = {
-                   'memory': InMemoryBuffer
+                   'memory': InMemoryBuffer,
+                   'compact': CompactBuffer,
+                   'tiered': TieredBuffer,
+                   'sqlite': SQLiteBuffer,
+                   'mmap': MmapBuffer
                   }
 
 
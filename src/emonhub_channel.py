@@ -0,0 +1,238 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import os
+import time
+import select
+import logging
+import threading
+from collections import deque
+
+# What to do with a new item when a bounded channel is full
+#   drop-oldest      discard the oldest queued item to make room (default)
+#   drop-newest      discard the new item
+#   block-producer   make the producer wait for room, up to block_timeout
+#                    seconds, then discard the new item
+#   spill-to-buffer  hand the new item to the spill callable, typically the
+#                    subscriber's add() so it lands straight in its buffer
+OVERFLOW_POLICIES = ('drop-oldest', 'drop-newest', 'block-producer', 'spill-to-buffer')
+
+"""class EmonHubChannel
+
+Thread-safe FIFO queue carrying cargo items for one pub or sub channel.
+
+Publishers put() items into the channel, the consumer takes them all at
+once with get_all(). Every put() sets the channel's wakeup event so that
+a consumer blocked on it is woken straight away instead of waiting for
+its next polling tick.
+
+A channel can be bounded (size > 0), what happens when it is full depends
+on the overflow policy. Items dropped or spilled and the highest number of
+queued items seen are counted so that channel sizes can be tuned.
+
+"""
+
+class EmonHubChannel:
+
+    def __init__(self, name, wakeup=None, size=0, overflow='drop-oldest', spill=None, block_timeout=1.0):
+        self.name = name
+        # threading.Event like object set each time an item is added
+        self.wakeup = wakeup
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._log = logging.getLogger("EmonHub")
+
+        self.configure(size, overflow, spill, block_timeout)
+
+        # Counters
+        self.dropped = 0
+        self.spilled = 0
+        self.high_watermark = 0
+        self._drop_log_timestamp = 0
+
+    def configure(self, size=0, overflow='drop-oldest', spill=None, block_timeout=1.0):
+        """Set capacity (0 for unbounded) and overflow policy."""
+
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Invalid overflow policy: " + str(overflow))
+        with self._lock:
+            self.size = int(size)
+            self.overflow = overflow
+            self.spill = spill
+            self.block_timeout = block_timeout
+            # Wake up producers blocked on a now larger (or different) channel
+            self._not_full.notify_all()
+
+    def put(self, item):
+        """Append an item and wake up the consumer.
+
+        Return False if the item was dropped because the channel is full.
+
+        """
+
+        spill = None
+        with self._lock:
+            if self.size and len(self._items) >= self.size:
+                if self.overflow == 'drop-oldest':
+                    self._items.popleft()
+                    self._count_drop()
+                elif self.overflow == 'block-producer':
+                    if not self._not_full.wait_for(lambda: len(self._items) < self.size, self.block_timeout):
+                        self._count_drop()
+                        return False
+                elif self.overflow == 'spill-to-buffer' and self.spill is not None:
+                    self.spilled += 1
+                    spill = self.spill
+                else:
+                    # 'drop-newest' or nowhere to spill to
+                    self._count_drop()
+                    return False
+
+            if spill is None:
+                self._items.append(item)
+                if len(self._items) > self.high_watermark:
+                    self.high_watermark = len(self._items)
+
+        if spill is not None:
+            # Outside of the lock, the consumer may be busy with the channel
+            spill(item)
+            return True
+
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return True
+
+    def put_many(self, items):
+        """Append items, oldest first, and wake up the consumer.
+
+        The lock is taken once if there is room for all of them, otherwise
+        each item is put() in turn for the overflow policy to apply.
+
+        """
+
+        with self._lock:
+            room = not self.size or len(self._items) + len(items) <= self.size
+            if room:
+                self._items.extend(items)
+                if len(self._items) > self.high_watermark:
+                    self.high_watermark = len(self._items)
+
+        if not room:
+            for item in items:
+                self.put(item)
+        elif self.wakeup is not None:
+            self.wakeup.set()
+
+    def _count_drop(self):
+        """Count a dropped item and log it, at most once a minute (lock held)."""
+
+        self.dropped += 1
+        now = time.time()
+        if now - self._drop_log_timestamp >= 60:
+            self._drop_log_timestamp = now
+            self._log.warning("Channel %s full (%d items, %s), %d items dropped so far"
+                              % (self.name, self.size, self.overflow, self.dropped))
+
+    def get(self):
+        """Pop the oldest item, or return None if the channel is empty."""
+        with self._lock:
+            if self._items:
+                item = self._items.popleft()
+                self._not_full.notify()
+                return item
+
+    def get_all(self):
+        """Pop and return all the items currently queued, oldest first."""
+        with self._lock:
+            items = list(self._items)
+            self._items.clear()
+            if items:
+                self._not_full.notify_all()
+        return items
+
+    def stats(self):
+        """Return the channel counters as a dict."""
+        return {'size': self.size,
+                'queued': len(self._items),
+                'high_watermark': self.high_watermark,
+                'dropped': self.dropped,
+                'spilled': self.spilled}
+
+    def __len__(self):
+        return len(self._items)
+
+
+"""class EmonHubWakeup
+
+threading.Event like flag that can be waited on together with file
+descriptors, using a self-pipe so that set() from any thread wakes up a
+select() call.
+
+"""
+
+class EmonHubWakeup:
+
+    def __init__(self):
+        self._flag = False
+        self._lock = threading.Lock()
+        self._r, self._w = os.pipe()
+        os.set_blocking(self._r, False)
+        os.set_blocking(self._w, False)
+
+    def set(self):
+        with self._lock:
+            if self._flag:
+                return
+            self._flag = True
+        try:
+            os.write(self._w, b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def is_set(self):
+        return self._flag
+
+    def clear(self):
+        with self._lock:
+            self._flag = False
+            try:
+                os.read(self._r, 512)
+            except (BlockingIOError, OSError):
+                pass
+
+    def wait(self, timeout=None, fds=()):
+        """Block until set, one of fds is readable or timeout (seconds) expires.
+
+        fds (list): file descriptors or objects with a fileno() method
+
+        Return True if the flag is set.
+
+        """
+
+        if self._flag:
+            return True
+        try:
+            select.select([self._r] + list(fds), [], [], timeout)
+        except (OSError, ValueError):
+            # A descriptor has been closed under our feet, don't spin
+            time.sleep(timeout if timeout is not None else 0.1)
+        return self._flag
+
+    def close(self):
+        for fd in (self._r, self._w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._r = self._w = -1
+
+    def __del__(self):
+        if self._r >= 0:
+            self.close()
@@ -1,6 +1,15 @@
 import struct
+import types
+from array import array
 
-# Initialize nodes data
+try:
+    import numpy as np
+    numpy_found = True
+except ImportError:
+    numpy_found = False
+
+# Initialize nodes data: the [nodes] section as read, see load_nodes()
+# for the checked settings interfacers use
 nodelist = {}
 
 
@@ -11,29 +20,584 @@ def check_datacode(datacode):
         return False
 
 
-def decode(datacode, frame):
-    # Ensure little-endian & standard sizes used
-    e = '<'
+# struct.Struct objects by datacode string, all with little-endian & standard
+# sizes, so that each format is compiled only once
+_structs = {}
+_STRUCTS_MAX = 1024
+
+
+def get_struct(datacodes):
+    """Return the compiled struct.Struct of a datacode string, eg 'hhL' or '6h'.
+
+    Raise struct.error if the datacodes are not valid.
+
+    """
+
+    frame_struct = _structs.get(datacodes)
+    if frame_struct is None:
+        frame_struct = struct.Struct('<' + datacodes)
+        if len(_structs) >= _STRUCTS_MAX:
+            _structs.clear()
+        _structs[datacodes] = frame_struct
+    return frame_struct
+
+
+def decode_many(datacodes, data, offset=0):
+    """Return the tuple of values packed in data, eg a whole frame at once.
+
+    datacodes (string): one datacode per value, eg 'hhL', or a count, eg '6h'
+    data (bytes, bytearray or memoryview): at least the size of the datacodes
+    from offset, bytes past it are ignored
+
+    """
+
+    return get_struct(datacodes).unpack_from(data, offset)
+
+
+def encode_many(datacodes, values):
+    """Return values packed as bytes.
+
+    datacodes (string): one datacode per value, eg 'hhL', or a count, eg '6h'
+    values (sequence): as many values as datacodes
+
+    """
 
-    # set the base data type to bytes
-    b = 'B'
+    return get_struct(datacodes).pack(*values)
 
-    # get data size from data code
-    s = int(check_datacode(datacode))
 
-    result = struct.unpack(e + datacode[0], struct.pack(e + b*s, *frame))
-    return result[0]
+def decode(datacode, frame):
+    # frame is a list of byte values for a single value
+    return get_struct(datacode[0]).unpack(bytes(frame))[0]
 
 def encode(datacode, value):
-    # Ensure little-endian & standard sizes used
-    e = '<'
+    # tuple of byte values
+    return tuple(get_struct(datacode).pack(value))
+
+
+def _datacode(code):
+    code = str(code)
+    if code != '0' and not check_datacode('<' + code):
+        raise ValueError("invalid datacode " + code)
+    return code
+
+
+# Node rx and tx settings, each given either as a single value, eg datacode,
+# or as a list, eg datacodes, and the type of their values
+_NODE_FIELDS = (('name', str), ('datacode', _datacode), ('scale', float),
+                ('register', int), ('unitId', int), ('channel', str), ('voice', str))
+
+
+"""class EmonHubNodeSection
+
+rx or tx settings of a node, checked once when the [nodes] section is
+loaded. For each setting, eg datacode, the single value is an attribute of
+the same name, eg datacode, and the list an attribute with an s, eg
+datacodes, a tuple. Settings not given are None.
+
+Values are typed: registers and unitIds are int, scales float, datacodes
+are valid struct datacodes or '0'. whitening is a bool.
+
+section (dict): rx or tx section of the node
+
+Raise ValueError if a value is invalid.
+
+"""
+
+class EmonHubNodeSection:
+
+    __slots__ = ('whitening',) + tuple(name for field, kind in _NODE_FIELDS for name in (field, field + 's'))
+
+    def __init__(self, section):
+        for field, kind in _NODE_FIELDS:
+            value = section.get(field)
+            if isinstance(value, (list, tuple)):
+                raise ValueError(field + " " + str(value) + " has many values, use " + field + "s")
+            object.__setattr__(self, field, None if value is None else kind(value))
+
+            values = section.get(field + 's')
+            if values is not None:
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                values = tuple(kind(value) for value in values)
+            object.__setattr__(self, field + 's', values)
+
+        whitening = section.get('whitening')
+        object.__setattr__(self, 'whitening', whitening is True or whitening == "1")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("node settings are read-only, can't set " + name)
+
+    def values(self, field):
+        """Return the list of a setting, eg datacodes, if given, else its
+        single value, eg datacode, as a tuple, empty if neither is given."""
+
+        values = getattr(self, field + 's')
+        if values is not None:
+            return values
+        value = getattr(self, field)
+        return () if value is None else (value,)
+
+
+# Settings of a node without rx or tx section
+_NO_SECTION = EmonHubNodeSection({})
+
+
+"""class EmonHubNodeConfig
+
+Settings of a node of the [nodes] section, checked once when loaded.
+
+nodeid (string): node id, the key of the node in the [nodes] section
+nodename: node name, False if not given
+rx, tx (EmonHubNodeSection): None if the node has no such section
+error (string): why the settings are invalid, None if valid; rx and tx are
+then None
+
+"""
+
+class EmonHubNodeConfig:
+
+    __slots__ = ('nodeid', 'nodename', 'rx', 'tx', 'error')
+
+    def __init__(self, nodeid, conf):
+        object.__setattr__(self, 'nodeid', str(nodeid))
+        object.__setattr__(self, 'nodename', conf.get('nodename', False))
+        object.__setattr__(self, 'error', None)
+        try:
+            for direction in ('rx', 'tx'):
+                section = conf.get(direction)
+                if isinstance(section, dict):
+                    section = EmonHubNodeSection(section)
+                elif section:
+                    raise ValueError(direction + " is not a section")
+                else:
+                    section = None
+                object.__setattr__(self, direction, section)
+        except (TypeError, ValueError) as e:
+            object.__setattr__(self, 'rx', None)
+            object.__setattr__(self, 'tx', None)
+            object.__setattr__(self, 'error', str(e))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("node settings are read-only, can't set " + name)
+
+
+"""class EmonHubNodeIndex
+
+Checked settings of the nodes of the [nodes] section, see load_nodes().
+
+ids: EmonHubNodeConfig by node id
+names: EmonHubNodeConfig by node name
+errors: (node id, why its settings are invalid) of the invalid nodes
+
+"""
+
+class EmonHubNodeIndex:
+
+    __slots__ = ('ids', 'names', 'errors')
+
+    def __init__(self, nodelist=None):
+        ids = {}
+        names = {}
+        errors = []
+        for nodeid, conf in (nodelist or {}).items():
+            if not isinstance(conf, dict):
+                errors.append((str(nodeid), "not a section"))
+                continue
+            node = ids[str(nodeid)] = EmonHubNodeConfig(nodeid, conf)
+            if node.error:
+                errors.append((node.nodeid, node.error))
+            if node.nodename:
+                names.setdefault(str(node.nodename), node)
+        self.ids = types.MappingProxyType(ids)
+        self.names = types.MappingProxyType(names)
+        self.errors = tuple(errors)
+
+    def get(self, node):
+        """Return the settings of a node given its id or name, None if not listed."""
+        node = str(node)
+        return self.ids.get(node) or self.names.get(node)
+
+    def __contains__(self, node):
+        return self.get(node) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+
+nodes = EmonHubNodeIndex()
+
+
+def load_nodes(section):
+    """Check the [nodes] section and make it the current node index.
+
+    The index is built before it replaces the previous one, in a single
+    assignment, so that interfacers reading ehc.nodes always get either
+    the old or the new settings.
+
+    Return the new EmonHubNodeIndex.
+
+    """
+
+    global nodelist, nodes
+    index = EmonHubNodeIndex(section)
+    nodelist = section
+    nodes = index
+    return index
+
+
+# numpy types of the datacodes, with the same standard sizes as struct
+_NUMPY_TYPES = {'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4',
+                'l': '<i4', 'L': '<u4', 'q': '<i8', 'Q': '<u8', 'f': '<f4', 'd': '<f8'}
+
+# Below this number of frames of the same size, frames are decoded one by one
+BATCH_MIN = 8
+
+# Byte values XORed with 0x55, see rx 'whitening' used to ensure rfm sync
+WHITENING = bytes(i ^ 0x55 for i in range(256))
+
+
+def _scale_factor(scale):
+    """Return the float to multiply values by, None for a scale of 1."""
+    scale = float(scale)
+    return None if scale == 1 else scale
+
+
+"""class EmonHubRxPlan
+
+Decoding of the frames received from a node, compiled once from its [nodes]
+settings: the datacodes become a struct.Struct with standard sizes, so that
+decoding a frame is a single unpack_from followed by the scale multiplies.
+
+nodeconf (EmonHubNodeConfig): settings of the node, None if not listed
+datacode, scale: interfacer defaults, used if the node has none
+
+Raise ValueError if the settings are invalid.
+
+"""
+
+class EmonHubRxPlan:
+
+    def __init__(self, nodeconf, datacode='0', scale='1'):
+        self.defaults = (datacode, scale)
+        if nodeconf is not None and nodeconf.error:
+            raise ValueError(nodeconf.error)
+        rx = nodeconf and nodeconf.rx or _NO_SECTION
+
+        self.nodename = nodeconf.nodename if nodeconf else False
+        # None to keep the names set by the interfacer
+        self.names = rx.names
+        self.whitening = rx.whitening
+
+        # Datacodes: either one per value (struct of fixed size) or a single
+        # one for all values, '0' meaning values are passed through
+        self.datacodes = None
+        self.code = None
+        self.struct = None
+        self._structs = {}
+        if rx.datacodes is not None:
+            self.datacodes = list(rx.datacodes)
+            self.size = sum(check_datacode('<' + code) or 0 for code in self.datacodes)
+            try:
+                self.struct = get_struct(''.join(self.datacodes))
+            except struct.error:
+                pass
+        else:
+            code = str(datacode) if rx.datacode is None else rx.datacode
+            if code and code != '0':
+                self.code = code
+                self.size = check_datacode('<' + self.code)
+                if not self.size:
+                    raise ValueError("invalid datacode " + self.code)
+
+        # Scales: one per value (1 for values without), or one for all
+        self.scales = None
+        self.scale = None
+        if rx.scales is not None:
+            self.scales = [_scale_factor(x) for x in rx.scales]
+            if not any(x is not None for x in self.scales):
+                self.scales = None
+        else:
+            self.scale = _scale_factor(scale if rx.scale is None else rx.scale)
+
+        # numpy dtype to decode many frames at once, None if not supported
+        self._dtype = None
+        if numpy_found:
+            if self.datacodes is not None and self.struct is not None:
+                if all(code in _NUMPY_TYPES for code in self.datacodes):
+                    self._dtype = np.dtype({'names': ['v%d' % i for i in range(len(self.datacodes))],
+                                            'formats': [_NUMPY_TYPES[code] for code in self.datacodes]})
+            elif self.code in _NUMPY_TYPES:
+                self._dtype = np.dtype(_NUMPY_TYPES[self.code])
+
+    def decode(self, realdata):
+        """Return the list of values of a frame.
+
+        realdata (list): byte values, or values to pass through if datacode
+        is 0, as int or numerical strings
+
+        Raise ValueError, with the reason as message, if the frame is invalid.
+
+        """
+
+        if self.datacodes is None and self.code is None:
+            values = self._passthrough(realdata)
+        else:
+            data = self._bytes(realdata)
+            if self.whitening:
+                data = bytes(data).translate(WHITENING)
+            if self.code is None:
+                if len(data) != self.size:
+                    raise ValueError("RX data length: " + str(len(data)) +
+                                     " is not valid for datacodes " + str(self.datacodes))
+                frame_struct = self.struct
+                if frame_struct is None:
+                    raise ValueError("Unable to decode as values incorrect for datacode(s)")
+            else:
+                if len(data) % self.size:
+                    raise ValueError("RX data length: " + str(len(data)) +
+                                     " is not valid for datacode " + self.code)
+                frame_struct = self._structs.get(len(data))
+                if frame_struct is None:
+                    frame_struct = get_struct('%d%s' % (len(data) // self.size, self.code))
+                    self._structs[len(data)] = frame_struct
+            try:
+                values = list(frame_struct.unpack_from(data))
+            except struct.error:
+                raise ValueError("Unable to decode as values incorrect for datacode(s)")
+
+        if self.scales is not None:
+            for i, x in enumerate(self.scales[:len(values)]):
+                if x is not None:
+                    val = values[i] * x
+                    values[i] = int(val) if val % 1 == 0 else val
+        elif self.scale is not None:
+            x = self.scale
+            for i, val in enumerate(values):
+                val = val * x
+                values[i] = int(val) if val % 1 == 0 else val
+        return values
+
+    def decode_frames(self, frames):
+        """Decode many frames received from the node, eg in a burst.
+
+        Frames of the same size are decoded together with numpy if it is
+        installed, the others one by one with decode().
+
+        Return, for each frame, its list of values or the ValueError raised
+        by decode().
+
+        """
+
+        results = [None] * len(frames)
+        if self._dtype is not None and len(frames) >= BATCH_MIN:
+            sizes = {}
+            for i, frame in enumerate(frames):
+                sizes.setdefault(len(frame), []).append(i)
+            for indexes in sizes.values():
+                if len(indexes) >= BATCH_MIN:
+                    values = self._decode_array([frames[i] for i in indexes])
+                    if values is not None:
+                        for i, frame_values in zip(indexes, values):
+                            results[i] = frame_values
+
+        for i, frame_values in enumerate(results):
+            if frame_values is None:
+                try:
+                    results[i] = self.decode(frames[i])
+                except ValueError as e:
+                    results[i] = e
+        return results
+
+    def _decode_array(self, frames):
+        """Decode frames of the same size with numpy, as decode() does.
+
+        Return the lists of values, or None if the frames have to be decoded
+        one by one, eg to find out which are invalid.
+
+        """
+
+        size = len(frames[0])
+        if not size or size % self.size or (self.code is None and size != self.size):
+            return None
+
+        try:
+            if isinstance(frames[0], (bytes, bytearray, memoryview)):
+                data = b''.join(frames)
+            else:
+                array = np.array(frames, dtype=np.int64)
+                if array.ndim != 2 or array.min() < 0 or array.max() > 255:
+                    return None
+                data = array.astype(np.uint8).tobytes()
+        except (TypeError, ValueError, OverflowError):
+            return None
+        if self.whitening:
+            data = data.translate(WHITENING)
+
+        array = np.frombuffer(data, dtype=self._dtype)
+        if self.code is None:
+            columns = [array[name] for name in self._dtype.names]
+        else:
+            columns = array.reshape(len(frames), -1).T
+
+        lists = []
+        for i, column in enumerate(columns):
+            if self.scales is not None:
+                x = self.scales[i] if i < len(self.scales) else None
+            else:
+                x = self.scale
+            lists.append(column.tolist() if x is None else _scaled_list(column, x))
+        return [list(values) for values in zip(*lists)]
+
+    def _bytes(self, realdata):
+        """Return the frame as bytes."""
+
+        if isinstance(realdata, (bytes, memoryview)):
+            # raw frame, see the interfacers 'rawbytes' setting
+            return realdata
+        if isinstance(realdata, array):
+            # cargo values, not their machine representation
+            realdata = realdata.tolist()
+        try:
+            return bytes(realdata)
+        except TypeError:
+            # numerical strings
+            try:
+                return bytes(int(v) for v in realdata)
+            except (TypeError, ValueError):
+                pass
+        except ValueError:
+            # out of the 0-255 range
+            pass
+        # Tell non-numerical content apart
+        self._passthrough(realdata)
+        raise ValueError("Unable to decode as values incorrect for datacode(s)")
+
+    def _passthrough(self, realdata):
+        """Values as int if integral else float, for datacode 0."""
+
+        values = []
+        try:
+            for val in realdata:
+                val = float(val)
+                if self.whitening:
+                    val = int(val) ^ 0x55
+                values.append(int(val) if val % 1 == 0 else val)
+        except (TypeError, ValueError):
+            raise ValueError("Discarded RX frame 'non-numerical content' : " + str(realdata))
+        return values
+
+
+"""class EmonHubTxPlan
+
+Encoding of the frames sent to a node, compiled once from its [nodes] tx
+settings: the scaled values of a frame are packed with a single
+struct.Struct.pack_into into a buffer reused from frame to frame.
+
+nodeconf (EmonHubNodeConfig): settings of the node, None if not listed
+datacode, scale: interfacer defaults, used if the node has none
+
+Raise ValueError if the settings are invalid.
+
+"""
+
+class EmonHubTxPlan:
+
+    def __init__(self, nodeconf, datacode='h', scale='1'):
+        self.defaults = (datacode, scale)
+        if nodeconf is not None and nodeconf.error:
+            raise ValueError(nodeconf.error)
+        tx = nodeconf and nodeconf.tx or _NO_SECTION
+
+        # Scales: one per value, or one for all
+        self.scales = None
+        self.scale = None
+        if tx.scales is not None:
+            self._scales = list(tx.scales)
+            self.scales = [_scale_factor(x) for x in self._scales]
+        else:
+            self.scale = _scale_factor(scale if tx.scale is None else tx.scale)
+
+        # Datacodes: one per value, or one for all values, '0' meaning values
+        # are passed through
+        self.datacodes = None
+        self.code = None
+        self._packers = {}
+        if tx.datacodes is not None:
+            self.datacodes = list(tx.datacodes)
+            self._packer(len(self.datacodes))
+        else:
+            code = str(datacode) if tx.datacode is None else tx.datacode
+            if code and code != '0':
+                self.code = code
+                self._packer(1)
+
+    def _packer(self, count):
+        """Return the struct and buffer packing a frame of count values."""
+
+        packer = self._packers.get(count)
+        if packer is None:
+            if self.datacodes is not None:
+                frame_struct = get_struct(''.join(self.datacodes))
+            else:
+                frame_struct = get_struct('%d%s' % (count, self.code))
+            packer = (frame_struct, bytearray(frame_struct.size))
+            self._packers[count] = packer
+        return packer
+
+    def encode(self, dest, realdata):
+        """Return the frame to send to dest as [dest, byte1, byte2, ...], or
+        [dest, val1, val2, ...] if datacode is 0.
+
+        Raise ValueError, with the reason as message, if the values can't be
+        encoded.
+
+        """
+
+        if self.scales is not None:
+            if len(realdata) != len(self.scales):
+                raise ValueError("Scales " + str(self._scales) + " for TX data : " + str(realdata) + " not suitable ")
+            scaled = [val if x is None else _unscale(val, x) for val, x in zip(realdata, self.scales)]
+        elif self.scale is not None:
+            scaled = [_unscale(val, self.scale) for val in realdata]
+        else:
+            scaled = realdata
+
+        encoded = [dest]
+        if self.datacodes is None and self.code is None:
+            for val in scaled:
+                val = float(val)
+                encoded.append(int(val) if val % 1 == 0 else val)
+            return encoded
+
+        if self.datacodes is not None and len(scaled) != len(self.datacodes):
+            raise ValueError("TX datacodes: " + str(self.datacodes) + " are not valid for values " + str(scaled))
+
+        frame_struct, buf = self._packer(len(scaled))
+        try:
+            frame_struct.pack_into(buf, 0, *[int(val) for val in scaled])
+        except (struct.error, TypeError, ValueError):
+            raise ValueError("TX values " + str(scaled) + " can't be encoded with datacode(s) " +
+                             str(self.datacodes or self.code))
+        encoded.extend(buf)
+        return encoded
+
+
+def _scaled_list(column, scale):
+    """Return the values of a numpy array multiplied by scale, as a list of
+    int if integral else float, like EmonHubRxPlan.decode does."""
 
-    # set the base data type to bytes
-    b = 'B'
+    with np.errstate(invalid='ignore', over='ignore'):
+        scaled = column.astype(np.float64) * scale
+        integral = np.mod(scaled, 1) == 0
+    if not integral.any():
+        return scaled.tolist()
+    if np.abs(scaled[integral]).max() >= 2**63:
+        return [int(val) if val % 1 == 0 else val for val in scaled.tolist()]
+    values = scaled.astype(object)
+    values[integral] = scaled[integral].astype(np.int64).astype(object)
+    return values.tolist()
 
-    # get data size from data code
-    s = int(check_datacode(datacode))
 
-    #value = 60
-    #datacode = "b"
-    return struct.unpack(e + b*s, struct.pack(e + datacode, value))
+def _unscale(val, scale):
+    val = float(val) / scale
+    return int(val) if val % 1 == 0 else val
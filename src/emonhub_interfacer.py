@@ -7,7 +7,10 @@
 
 """
 
+import os
 import time
+import json
+import struct
 import logging
 import threading
 import traceback
@@ -15,6 +18,13 @@ import requests
 
 import emonhub_coder as ehc
 import emonhub_buffer as ehb
+import emonhub_channel as ehch
+import Cargo
+
+# Interfacers being rebuilt on a settings update, by name. The instance
+# replacing one takes its connections over (see _inherit) when created
+# and its buffered data (see take_over) before being started.
+handover = {}
 
 """class EmonHubInterfacer
 
@@ -50,17 +60,33 @@ class EmonHubInterfacer(threading.Thread):
                           'scale': '1',
                           'timestamped': False,
                           'targeted': False,
+                          'rawbytes': False,
                           'nodeoffset': '0',
                           'pubchannels': [],
                           'subchannels': [],
-                          'batchsize': '1'}
+                          'batchsize': '1',
+                          'channelsize': '1000',
+                          'channeloverflow': 'drop-oldest',
+                          'buffer_type': 'memory',
+                          'buffer_size': '1000',
+                          'buffer_bytes': '0',
+                          'buffer_path': '',
+                          'buffer_overflow': 'drop-oldest'}
 
         self.init_settings = {}
         self._settings = {}
 
-        # Initialise message queue
+        # Name of the worker process running the interfacer, None for the hub process
+        self.process = None
+
+        # Initialise message queues, sub channels wake this interfacer up
+        # as soon as cargo is routed to them
         self._sub_channels = {}
         self._pub_channels = {}
+        self._wakeup = ehch.EmonHubWakeup()
+
+        # Event set whenever cargo is published, the hub waits on it
+        self._pub_wakeup = None
 
         # This line will stop the default values printing to logfile at start-up
         # unless they have been overwritten by emonhub.conf entries
@@ -70,20 +96,45 @@ class EmonHubInterfacer(threading.Thread):
         # Initialize interval timer's "started at" timestamp
         self._interval_timestamp = 0
 
-        buffer_type = "memory"
-        buffer_size = 1000
-
-        # Create underlying buffer implementation
-        self.buffer = ehb.getBuffer(buffer_type)(name, buffer_size)
+        # Create underlying buffer implementation, replaced as the buffer
+        # settings change, see _configure_buffer
+        self.buffer = None
+        self._buffer_config = None
+        self._configure_buffer()
 
         # set an absolute upper limit for number of items to process per post
         # number of items posted is the lower of this item limit, buffer_size, or the
         # batchsize, as set in reporter settings or by the default value.
-        self._item_limit = buffer_size
+        self._item_limit = int(self._defaults['buffer_size'])
 
         # create a stop
         self.stop = False
 
+        # Interfacer this one replaces, if being rebuilt
+        self._predecessor = handover.pop(name, None)
+        # Endpoint settings of the connections held, by attribute name
+        self._endpoints = {}
+        # Cleared by the hub if the thread died, its connections may be broken
+        self._reusable = True
+
+        # Set on shutdown, input is no longer read
+        self._draining = False
+
+        # Compiled rx and tx settings by node, for the current ehc.nodes
+        self._plans = {}
+        self._plans_nodes = None
+
+    @property
+    def stop(self):
+        return self._stop_requested
+
+    @stop.setter
+    def stop(self, value):
+        # Wake the thread up so that it notices it has to stop
+        self._stop_requested = value
+        if value:
+            self._wakeup.set()
+
     @log_exceptions_from_class_method
     def run(self):
         """
@@ -93,39 +144,180 @@ class EmonHubInterfacer(threading.Thread):
         """
         while not self.stop:
 
-            # Only read if there is a pub channel defined for the interfacer
-            if len(self._settings["pubchannels"]):
-                # Read the input and process data if available
-                rxc = self.read()
-                if rxc:
-                    rxc = self._process_rx(rxc)
-                    if rxc:
-                        for channel in self._settings["pubchannels"]:
-                            self._log.debug(str(rxc.uri) + " Sent to channel(start)' : " + str(channel))
-
-                            # Initialise channel if needed
-                            if channel not in self._pub_channels:
-                                self._pub_channels[channel] = []
-
-                            # Add cargo item to channel
-                            self._pub_channels[channel].append(rxc)
+            # Set when more input may be waiting in the interfacer's own buffers
+            pending = False
 
-                            self._log.debug(str(rxc.uri) + " Sent to channel(end)' : " + str(channel))
+            # Only read if there is a pub channel defined for the interfacer
+            if len(self._settings["pubchannels"]) and not self._draining:
+                # Read the input and process data if available. When input
+                # readiness is signalled by file descriptors, read all the
+                # frames already received rather than one per loop
+                if self._wait_fds() is None:
+                    reads = 1
+                else:
+                    reads = 100
+                    pending = True
+                frames = []
+                while reads:
+                    reads -= 1
+                    rxc = self.read()
+                    if not rxc:
+                        pending = False
+                        break
+                    frames.append(rxc)
+                self._publish_many(self._process_rx_many(frames))
 
             # Subscriber channels
             for channel in self._settings["subchannels"]:
                 if channel in self._sub_channels:
-                    # FIXME should be: while self._sub_channels[channel]
-                    for _ in range(len(self._sub_channels[channel])):
-                        # FIXME pop(0) has O(n) complexity. Can we use pop's default of last?
-                        frame = self._sub_channels[channel].pop(0)
-                        self.add(frame)
-
-            # Don't loop too fast
-            time.sleep(0.1)
+                    for frame in self._sub_channels[channel].get_all():
+                        self._add_item(frame)
+
             # Action reporter tasks
             self.action()
 
+            # Sleep until there is something to do
+            if not pending:
+                self._wait()
+
+    def _wait(self):
+        """Block until there is input to read, cargo in a sub channel or action() is due."""
+
+        timeout = self._action_timeout()
+        fds = []
+        if len(self._settings["pubchannels"]) and not self._draining:
+            fds = self._wait_fds()
+            if fds is None:
+                # No file descriptor to wait on, read() has to be polled
+                fds = []
+                timeout = 0.1 if timeout is None else min(timeout, 0.1)
+
+        if self._wakeup.wait(timeout, fds):
+            self._wakeup.clear()
+
+    def _wait_fds(self):
+        """Return the file descriptors signalling input is ready for read().
+
+        Interfacers reading from a serial port or a socket return it here so
+        that their thread sleeps until data arrives. None (the default) means
+        read() has to be polled.
+
+        """
+        return None
+
+    def _action_timeout(self):
+        """Return the number of seconds until action() has some work to do.
+
+        None means there is nothing to do until woken up by new data.
+
+        """
+
+        # Nothing to flush or output paused
+        if not self.buffer.hasItems() \
+                or str(self._settings['pause']).lower() in ['all', 'out']:
+            return None
+
+        # Retry (or carry on flushing a large buffer) every 0.1s if no interval
+        interval = max(int(self._settings['interval']), 0.1)
+        return max(self._interval_timestamp + interval - time.time(), 0)
+
+    def _publish(self, cargo):
+        """Put a cargo item in each of the interfacer's pub channels.
+
+        The cargo is frozen, subscribers share it read-only.
+
+        """
+
+        cargo.freeze()
+        for channel in self._settings["pubchannels"]:
+            self._log.debug(str(cargo.uri) + " Sent to channel' : " + str(channel))
+            self._get_pub_channel(channel).put(cargo)
+
+    def _publish_many(self, cargos):
+        """Publish the cargos of a burst, as a single Cargo.EmonHubFrameBatch
+        if there are enough of them."""
+
+        if len(cargos) < ehc.BATCH_MIN:
+            for cargo in cargos:
+                self._publish(cargo)
+            return
+
+        batch = Cargo.EmonHubFrameBatch.from_cargos(cargos)
+        for channel in self._settings["pubchannels"]:
+            self._log.debug("Batch of " + str(len(batch)) + " frames sent to channel : " + str(channel))
+            self._get_pub_channel(channel).put(batch)
+
+    def _get_pub_channel(self, channel):
+        """Return the named pub channel, creating it if needed."""
+
+        if channel not in self._pub_channels:
+            c = ehch.EmonHubChannel(channel, self._pub_wakeup)
+            self._configure_channel(c)
+            self._pub_channels.setdefault(channel, c)
+        return self._pub_channels[channel]
+
+    def _get_sub_channel(self, channel):
+        """Return the named sub channel, creating it if needed."""
+
+        if channel not in self._sub_channels:
+            c = ehch.EmonHubChannel(channel, self._wakeup)
+            self._configure_channel(c, self._add_item)
+            self._sub_channels.setdefault(channel, c)
+        return self._sub_channels[channel]
+
+    def _configure_channel(self, channel, spill=None):
+        """Apply the channelsize and channeloverflow settings to a channel.
+
+        spill (callable): where items go when the channel overflows with the
+        'spill-to-buffer' policy, only meaningful for sub channels.
+
+        """
+
+        size = self._channel_setting('channelsize', channel.name)
+        overflow = self._channel_setting('channeloverflow', channel.name)
+        try:
+            channel.configure(int(size), overflow, spill)
+        except ValueError:
+            self._log.warning("Invalid channelsize '%s' or channeloverflow '%s' for %s channel %s, using defaults"
+                              % (size, overflow, self.name, channel.name))
+            channel.configure(int(self._defaults['channelsize']), self._defaults['channeloverflow'], spill)
+
+    def _channel_setting(self, key, channel):
+        """Return the value of a per channel setting for the named channel.
+
+        The setting is either a single value applying to all the channels or
+        a list of a default value and 'channel:value' overrides,
+        eg: 'channelsize = 1000, ToRFM12:50'
+
+        """
+
+        setting = self._settings.get(key, self._defaults[key])
+        if not isinstance(setting, (list, tuple)):
+            setting = [setting]
+        value = self._defaults[key]
+        for item in setting:
+            item = str(item).strip()
+            if ':' in item:
+                name, item = item.rsplit(':', 1)
+                if name.strip() == channel:
+                    return item.strip()
+            else:
+                value = item
+        return value
+
+    def channel_stats(self):
+        """Return the counters of every pub and sub channel.
+
+        Returns a dict of {'pub:ToEmonCMS': {'size': 1000, 'dropped': 0, ...}}
+
+        """
+
+        stats = {}
+        for prefix, channels in (('pub', self._pub_channels), ('sub', self._sub_channels)):
+            for name, channel in list(channels.items()):
+                stats[prefix + ':' + name] = channel.stats()
+        return stats
+
     def add(self, cargo):
         """Append data to buffer.
 
@@ -143,6 +335,8 @@ class EmonHubInterfacer(threading.Thread):
                 f.append(i)
             if cargo.rssi:
                 f.append(cargo.rssi)
+                # Not to be averaged with the values, see ehb.downsample
+                self.buffer.markRssi(cargo.nodeid, len(f))
 
             # self._log.debug(str(cargo.uri) + " adding frame to buffer => "+ str(f))
 
@@ -162,6 +356,34 @@ class EmonHubInterfacer(threading.Thread):
 
         self.buffer.storeItem(f)
 
+    def add_batch(self, batch):
+        """Append a batch of frames to buffer, see add().
+
+        batch (Cargo.EmonHubFrameBatch): frames read in a burst
+
+        The frames go to the buffer in one go, unless the interfacer has its
+        own add(), which is then called with each frame.
+
+        """
+
+        if type(self).add is not EmonHubInterfacer.add:
+            for cargo in batch.cargos():
+                self.add(cargo)
+            return
+        rows = batch.rows()
+        for row, rssi in zip(rows, batch.rssis):
+            if rssi:
+                self.buffer.markRssi(row[1], len(row))
+        self.buffer.storeItems(rows)
+
+    def _add_item(self, item):
+        """Add a cargo or a batch of frames taken from a sub channel."""
+
+        if isinstance(item, Cargo.EmonHubFrameBatch):
+            self.add_batch(item)
+        else:
+            self.add(item)
+
     def read(self):
         """Read raw data from interface and pass for processing.
         Specific version to be created for each interfacer
@@ -261,7 +483,8 @@ class EmonHubInterfacer(threading.Thread):
 
         f (string): 'NodeID val1 val2 ...'
 
-        This function splits the string into numbers and check its validity.
+        This function decodes the values of the frame according to the
+        node's rx settings, see ehc.EmonHubRxPlan.
 
         'NodeID val1 val2 ...' is the generic data format. If the source uses
         a different format, override this method.
@@ -270,308 +493,288 @@ class EmonHubInterfacer(threading.Thread):
 
         """
 
-        # Log data
-        self._log.debug(str(cargo.uri) + " NEW FRAME : " + str(cargo.rawdata))
+        rxc = self._check_rx(cargo)
+        if not rxc:
+            return False
+
+        try:
+            plan = self._node_plan(ehc.EmonHubRxPlan, str(rxc.nodeid))
+            values = plan.decode(rxc.realdata)
+        except ValueError as e:
+            self._log.warning(str(rxc.uri) + " " + str(e))
+            return False
+
+        return self._decoded_rx(rxc, plan, values)
+
+    def _process_rx_many(self, cargos):
+        """Process the frames read in a burst, see _process_rx.
+
+        The frames received from the same node are decoded together, see
+        ehc.EmonHubRxPlan.decode_frames.
+
+        Return the list of valid cargos, in the order they were received.
+
+        """
+
+        if len(cargos) < ehc.BATCH_MIN or type(self)._process_rx is not EmonHubInterfacer._process_rx:
+            return [rxc for rxc in map(self._process_rx, cargos) if rxc]
+
+        nodes = {}
+        for rxc in cargos:
+            if self._check_rx(rxc):
+                nodes.setdefault(str(rxc.nodeid), []).append(rxc)
+
+        valid = set()
+        for node, node_cargos in nodes.items():
+            try:
+                plan = self._node_plan(ehc.EmonHubRxPlan, node)
+            except ValueError as e:
+                for rxc in node_cargos:
+                    self._log.warning(str(rxc.uri) + " " + str(e))
+                continue
+            results = plan.decode_frames([rxc.realdata for rxc in node_cargos])
+            for rxc, values in zip(node_cargos, results):
+                if isinstance(values, ValueError):
+                    self._log.warning(str(rxc.uri) + " " + str(values))
+                else:
+                    valid.add(id(self._decoded_rx(rxc, plan, values)))
+
+        return [rxc for rxc in cargos if id(rxc) in valid]
+
+    def _rx_values(self, tokens):
+        """Return the values of a received frame from its tokens, str or bytes.
 
-        rxc = cargo
-        decoded = []
-        node = str(rxc.nodeid)
-        datacode = True
+        With the 'rawbytes' setting, values all in the 0-255 range, as sent
+        by rfm nodes, are kept as a bytes object that the node rx plan decodes
+        as is. Otherwise the values are returned as a list of strings.
+
+        """
+
+        if self._settings['rawbytes']:
+            try:
+                return bytes(map(int, tokens))
+            except ValueError:
+                pass
+        return [v.decode(errors='replace') if isinstance(v, bytes) else v for v in tokens]
+
+    def _check_rx(self, rxc):
+        """Log a received frame, return False if it is empty."""
+
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug(str(rxc.uri) + " NEW FRAME : " + str(rxc.rawdata))
 
         # Discard if data is non-existent
         if len(rxc.realdata) < 1:
-            self._log.warning(str(cargo.uri) + " Discarded RX frame 'string too short' : " + str(rxc.realdata))
+            self._log.warning(str(rxc.uri) + " Discarded RX frame 'string too short' : " + str(rxc.realdata))
             return False
+        return rxc
 
-        # Discard if anything non-numerical found
-        try:
-            [float(val) for val in rxc.realdata]
-        except Exception:
-            self._log.warning(str(cargo.uri) + " Discarded RX frame 'non-numerical content' : " + str(rxc.realdata))
-            return False
+    def _decoded_rx(self, rxc, plan, values):
+        """Set the decoded values and the node settings of a received frame."""
 
-        # Discard if first value is not a valid node id
-        # n = float(rxc.realdata[0])
-        # if n % 1 != 0 or n < 0 or n > 31:
-        #     self._log.warning(str(cargo.uri) + " Discarded RX frame 'node id outside scope' : " + str(rxc.realdata))
-        #     return False
-
-        # Data whitening uses for ensuring rfm sync
-        if node in ehc.nodelist and 'rx' in ehc.nodelist[node] and 'whitening' in ehc.nodelist[node]['rx']:
-            whitening = ehc.nodelist[node]['rx']['whitening']
-            if whitening is True or whitening == "1":
-                for i in range(len(rxc.realdata)):
-                    rxc.realdata[i] = rxc.realdata[i] ^ 0x55
-
-        # check if node is listed and has individual datacodes for each value
-        if node in ehc.nodelist and 'rx' in ehc.nodelist[node] and 'datacodes' in ehc.nodelist[node]['rx']:
-            # fetch the string of datacodes
-            datacodes = ehc.nodelist[node]['rx']['datacodes']
-
-            # fetch a string of data sizes based on the string of datacodes
-            datasizes = []
-            for code in datacodes:
-                datasizes.append(ehc.check_datacode(str(code)))
-            # Discard the frame & return 'False' if it doesn't match the summed datasizes
-            if len(rxc.realdata) != sum(datasizes):
-                self._log.warning(str(rxc.uri) + " RX data length: " + str(len(rxc.realdata)) +
-                                  " is not valid for datacodes " + str(datacodes))
-                return False
-            else:
-                # Determine the expected number of values to be decoded
-                count = len(datacodes)
-                # Set decoder to "Per value" decoding using datacode 'False' as flag
-                datacode = False
-        else:
-            # if node is listed, but has only a single default datacode for all values
-            if node in ehc.nodelist and 'rx' in ehc.nodelist[node] and 'datacode' in ehc.nodelist[node]['rx']:
-                datacode = ehc.nodelist[node]['rx']['datacode']
-            else:
-                # when node not listed or has no datacode(s) use the interfacers default if specified
-                datacode = self._settings['datacode']
-            # Ensure only int 0 is passed not str 0
-            if datacode == '0':
-                datacode = 0
-            # when no (default)datacode(s) specified, pass string values back as numerical values
-            if not datacode:
-                for val in rxc.realdata:
-                    if float(val) % 1 != 0:
-                        val = float(val)
-                    else:
-                        val = int(float(val))
-                    decoded.append(val)
-            # Discard frame if total size is not an exact multiple of the specified datacode size.
-            elif len(rxc.realdata) % ehc.check_datacode(datacode) != 0:
-                self._log.warning(str(rxc.uri) + " RX data length: " + str(len(rxc.realdata)) +
-                                  " is not valid for datacode " + str(datacode))
-                return False
-            else:
-            # Determine the number of values in the frame of the specified code & size
-                count = len(rxc.realdata) // ehc.check_datacode(datacode)
-
-        # Decode the string of data one value at a time into "decoded"
-        if not decoded:
-            bytepos = 0
-            for i in range(count):
-                # Use single datacode unless datacode = False then use datacodes
-                dc = str(datacode)
-                if not datacode:
-                    dc = str(datacodes[i])
-                # Determine the number of bytes to use for each value by it's datacode
-                size = int(ehc.check_datacode(dc))
-                try:
-                    value = ehc.decode(dc, [int(v) for v in rxc.realdata[bytepos:bytepos+size]])
-                except:
-                    self._log.warning(str(rxc.uri) + " Unable to decode as values incorrect for datacode(s)")
-                    return False
-                bytepos += size
-                decoded.append(value)
-
-        # check if node is listed and has individual scales for each value
-        if node in ehc.nodelist and 'rx' in ehc.nodelist[node] and 'scales' in ehc.nodelist[node]['rx']:
-            scales = ehc.nodelist[node]['rx']['scales']
-            # === Removed check for scales length so that failure mode is more gracious ===
-            # Discard the frame & return 'False' if it doesn't match the number of scales
-            # if len(decoded) != len(scales):
-            #     self._log.warning(str(rxc.uri) + " Scales " + str(scales) + " for RX data : " + str(rxc.realdata) + " not suitable " )
-            #     return False
-            # else:
-                  # Determine the expected number of values to be decoded
-                  # Set decoder to "Per value" scaling using scale 'False' as flag
-            #     scale = False
-            if len(scales) > 1:
-                scale = False
-            else:
-                scale = "1"
-        else:
-            # if node is listed, but has only a single default scale for all values
-            if node in ehc.nodelist and 'rx' in ehc.nodelist[node] and 'scale' in ehc.nodelist[node]['rx']:
-                scale = ehc.nodelist[node]['rx']['scale']
-            else:
-            # when node not listed or has no scale(s) use the interfacers default if specified
-                scale = self._settings['scale']
-
-        if scale != "1":
-            # FIXME replace with zip
-            for i in range(len(decoded)):
-                x = scale
-                if not scale:
-                    if i < len(scales):
-                        x = scales[i]
-                    else:
-                        x = 1
-
-                if x != "1":
-                    val = decoded[i] * float(x)
-                    if val % 1 == 0:
-                        decoded[i] = int(val)
-                    else:
-                        decoded[i] = float(val)
-
-        rxc.realdata = decoded
-        names = rxc.names
-
-        if node in ehc.nodelist and 'rx' in ehc.nodelist[node] and 'names' in ehc.nodelist[node]['rx']:
-            names = ehc.nodelist[node]['rx']['names']
-        rxc.names = names
-
-        nodename = False
-        if node in ehc.nodelist and 'nodename' in ehc.nodelist[node]:
-            nodename = ehc.nodelist[node]['nodename']
-        rxc.nodename = nodename
+        rxc.realdata = values
+        if plan.names is not None:
+            rxc.names = plan.names
+        rxc.nodename = plan.nodename
 
-        if not rxc:
-            return False
-        self._log.debug(str(rxc.uri) + " Timestamp : " + str(rxc.timestamp))
-        self._log.debug(str(rxc.uri) + " From Node : " + str(rxc.nodeid))
-        if rxc.target:
-            self._log.debug(str(rxc.uri) + " To Target : " + str(rxc.target))
-        self._log.debug(str(rxc.uri) + "    Values : " + str(rxc.realdata))
-        if rxc.rssi:
-            self._log.debug(str(rxc.uri) + "      RSSI : " + str(rxc.rssi))
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug(str(rxc.uri) + " Timestamp : " + str(rxc.timestamp))
+            self._log.debug(str(rxc.uri) + " From Node : " + str(rxc.nodeid))
+            if rxc.target:
+                self._log.debug(str(rxc.uri) + " To Target : " + str(rxc.target))
+            self._log.debug(str(rxc.uri) + "    Values : " + str(rxc.realdata))
+            if rxc.rssi:
+                self._log.debug(str(rxc.uri) + "      RSSI : " + str(rxc.rssi))
 
         return rxc
 
+    def _node_plan(self, plan_class, node):
+        """Return the compiled rx or tx settings of a node.
+
+        plan_class: ehc.EmonHubRxPlan or ehc.EmonHubTxPlan
+
+        Plans are cached until ehc.nodes is replaced by a settings update
+        or the interfacer's default datacode or scale change.
+
+        """
+
+        nodes = ehc.nodes
+        if nodes is not self._plans_nodes:
+            self._plans = {}
+            self._plans_nodes = nodes
+
+        plan = self._plans.get((plan_class, node))
+        defaults = (self._settings.get('datacode', 'h'), self._settings.get('scale', '1'))
+        if plan is None or plan.defaults != defaults:
+            try:
+                plan = plan_class(nodes.ids.get(node), *defaults)
+            except (TypeError, ValueError, struct.error) as e:
+                raise ValueError("Invalid settings for node " + node + ": " + str(e))
+            self._plans[(plan_class, node)] = plan
+        return plan
 
     def _process_tx(self, cargo):
         """Prepare data for outgoing transmission.
         cargo is passed through this chain of processing to scale
         and then break the real values down into byte values,
-        Uses the datacode data if available.
-
-        DO NOT OVER-WRITE THE "REAL" VALUE DATA WITH ENCODED DATA !!!
-        there may be other threads that need to use cargo.realdata to
-        encode data for other targets.
+        Uses the datacode data if available, see ehc.EmonHubTxPlan.
 
-        New "encoded" data is stored as a list of {interfacer:encoded-data} dicts.
+        The cargo is shared with the other subscribers and read-only, the
+        "encoded" data is held by a Cargo.EmonHubCargoView of the cargo, as
+        a {interfacer:encoded-data} dict.
 
-        Returns cargo.
+        Returns the view.
         """
 
         txc = cargo
-        scaled = []
-        encoded = []
 
         # Normal operation is dest from txc.nodeid
         if txc.target:
             dest = str(txc.target)
-            # self._log.info("dest from txc.target: " + dest)
         else:
             dest = str(txc.nodeid)
-            # self._log.info("dest from txc.nodeid: " + dest)
-
-        # self._log.info("Target: " + dest)
-        # self._log.info("Realdata: " + json.dumps(txc.realdata))
-
-        # check if node is listed and has individual scales for each value
-        if dest in ehc.nodelist and 'tx' in ehc.nodelist[dest] and 'scales' in ehc.nodelist[dest]['tx']:
-            scales = ehc.nodelist[dest]['tx']['scales']
-            # Discard the frame & return 'False' if it doesn't match the number of scales
-            if len(txc.realdata) != len(scales):
-                self._log.warning(str(txc.uri) + " Scales " + str(scales) + " for RX data : " + str(txc.realdata) +
-                                  " not suitable ")
-                return False
-            else:
-                # Determine the expected number of values to be decoded
 
-                # Set decoder to "Per value" scaling using scale 'False' as flag
-                scale = False
-        else:
-            # if node is listed, but has only a single default scale for all values
-            if dest in ehc.nodelist and 'tx' in ehc.nodelist[dest] and 'scale' in ehc.nodelist[dest]['tx']:
-                scale = ehc.nodelist[dest]['tx']['scale']
-            else:
-            # when node not listed or has no scale(s) use the interfacers default if specified
-                if 'scale' in self._settings:
-                    scale = self._settings['scale']
-                else:
-                    scale = "1"
+        try:
+            encoded = self._node_plan(ehc.EmonHubTxPlan, dest).encode(dest, txc.realdata)
+        except ValueError as e:
+            self._log.warning(str(txc.uri) + " " + str(e))
+            return False
 
-        if scale == "1":
-            scaled = txc.realdata
-        else:
-            for i in range(len(txc.realdata)):
-                x = scale
-                if not scale:
-                    x = scales[i]
-                if x == "1":
-                    val = txc.realdata[i]
-                else:
-                    val = float(txc.realdata[i]) / float(x)
-                    if val % 1 == 0:
-                        val = int(val)
-                scaled.append(val)
-
-        # self._log.info("Scaled: " + json.dumps(scaled))
-
-        # check if node is listed and has individual datacodes for each value
-        if dest in ehc.nodelist and 'tx' in ehc.nodelist[dest] and 'datacodes' in ehc.nodelist[dest]['tx']:
-
-            # fetch the string of datacodes
-            datacodes = ehc.nodelist[dest]['tx']['datacodes']
-
-            # fetch a string of data sizes based on the string of datacodes
-            datasizes = []
-            for code in datacodes:
-                datasizes.append(ehc.check_datacode(str(code)))
-            # Discard the frame & return 'False' if it doesn't match the summed datasizes
-            if len(scaled) != len(datasizes):
-                self._log.warning(str(txc.uri) + " TX datacodes: " + str(datacodes) +
-                                  " are not valid for values " + str(scaled))
-                return False
-            else:
-                # Determine the expected number of values to be decoded
-                count = len(scaled)
-                # Set decoder to "Per value" decoding using datacode 'False' as flag
-                datacode = False
-        else:
-            # if node is listed, but has only a single default datacode for all values
-            if dest in ehc.nodelist and 'tx' in ehc.nodelist[dest] and 'datacode' in ehc.nodelist[dest]['tx']:
-                datacode = ehc.nodelist[dest]['tx']['datacode']
-            else:
-            # when node not listed or has no datacode(s) use the interfacers default if specified
-                if 'datacode' in self._settings:
-                    datacode = self._settings['datacode']
-                else:
-                    datacode = "h"
-
-            # Ensure only int 0 is passed not str 0
-            if datacode == '0':
-                datacode = 0
-            # when no (default)datacode(s) specified, pass string values back as numerical values
-            if not datacode:
-                encoded.append(dest)
-
-                for val in scaled:
-                    if float(val) % 1 != 0:
-                        val = float(val)
-                    else:
-                        val = int(float(val))
-                    encoded.append(val)
-            # Discard frame if total size is not an exact multiple of the specified datacode size.
-            # elif len(data) * ehc.check_datacode(datacode) != 0:
-            #     self._log.warning(str(uri) + " TX data length: " + str(len(data)) +
-            #                       " is not valid for datacode " + str(datacode))
-            #     return False
-            else:
-            # Determine the number of values in the frame of the specified code & size
-                count = len(scaled) #/ ehc.check_datacode(datacode)
+        return Cargo.EmonHubCargoView(txc, {self.name: encoded})
+
+    def _inherit(self, attr, endpoint):
+        """Take a connection over from the interfacer this one replaces.
+
+        attr (string): attribute holding the connection, eg '_ser'
+        endpoint (tuple): settings the connection is opened with, eg
+        (com_port, com_baud). The connection is only reused if they are
+        unchanged.
+
+        Return the connection, or None if it has to be opened.
 
-        if not encoded:
-            encoded.append(dest)
-            for i in range(count):
-                # Use single datacode unless datacode = False then use datacodes
-                dc = str(datacode)
-                if not datacode:
-                    dc = str(datacodes[i])
+        """
+
+        self._endpoints[attr] = tuple(str(v) for v in endpoint)
+
+        old = self._predecessor
+        if old is None or not old._reusable or old._endpoints.get(attr) != self._endpoints[attr]:
+            return None
+        con = getattr(old, attr, None)
+        if not con:
+            return None
+        # The predecessor must not close it
+        setattr(old, attr, None)
+        self._log.debug("Reusing " + self.name + " " + attr + " connection")
+        return con
+
+    def take_over(self):
+        """Move the buffered data and queued cargo of the interfacer this
+        one replaces into this one. To be called before start()."""
+
+        old, self._predecessor = self._predecessor, None
+        if old is None:
+            return
+
+        # The predecessor's buffer is kept, and replaced if the buffer
+        # settings have changed
+        self.buffer, self._buffer_config = old.buffer, old._buffer_config
+        self._configure_buffer()
+        if self.buffer.hasItems():
+            self._log.info("%s took over %d buffered items" % (self.name, self.buffer.size()))
+
+        for channel, queue in list(old._sub_channels.items()):
+            for cargo in queue.get_all():
+                self._get_sub_channel(channel).put(cargo)
+        for channel, queue in list(old._pub_channels.items()):
+            for cargo in queue.get_all():
+                self._get_pub_channel(channel).put(cargo)
+
+    def close(self):
+        """Close the connections still held, once the thread has stopped.
+        To be implemented in subclass."""
+        pass
+
+    def drain(self):
+        """Stop reading input, first step of the hub shutdown."""
+        self._draining = True
+        self._wakeup.set()
+
+    def shutdown(self, deadline, path=None):
+        """Flush what is left once the thread has stopped, then close.
+
+        Queued cargo is added to the buffer, which is posted in batches as
+        large as allowed until empty, a post fails or the deadline (time.time()
+        value) is reached. Anything left is saved to path (a directory) to be
+        picked up by restore() on next start, unless the buffer is persistent.
+
+        """
 
-                for b in ehc.encode(dc, int(scaled[i])):
-                    encoded.append(b)
+        for channel in self._settings["subchannels"]:
+            if channel in self._sub_channels:
+                for frame in self._sub_channels[channel].get_all():
+                    self._add_item(frame)
 
-        # self._log.info("Encoded: "+json.dumps(encoded))
+        if str(self._settings['pause']).lower() not in ['all', 'out']:
+            while self.buffer.hasItems() and time.time() < deadline:
+                databuffer = self.buffer.retrieveItems(self._item_limit)
+                if not self._post_batch(databuffer):
+                    break
+                self.buffer.discardLastRetrievedItems(len(databuffer))
 
-        txc.encoded.update({self.getName():encoded})
-        return txc
+        if path or self.buffer.persistent:
+            self.persist(path)
+        self.close()
+
+    def _post_batch(self, databuffer):
+        """Post a batch of buffered items, return True on success."""
+        return self._process_post(databuffer)
+
+    def _persist_file(self, path):
+        return os.path.join(path, self.name + ".buffer.json")
+
+    def persist(self, path):
+        """Save the buffered items to a file in the path directory."""
+
+        if self.buffer.persistent:
+            # already on disk, sent after the next start
+            self.buffer.commit()
+            return
+        if not self.buffer.hasItems():
+            return
+        filename = self._persist_file(path)
+        items = []
+        while self.buffer.hasItems():
+            databuffer = self.buffer.retrieveItems(self._item_limit)
+            items.extend(databuffer)
+            self.buffer.discardLastRetrievedItems(len(databuffer))
+        try:
+            os.makedirs(path, exist_ok=True)
+            with open(filename + ".tmp", "w") as f:
+                json.dump(items, f)
+            os.replace(filename + ".tmp", filename)
+        except (OSError, TypeError, ValueError) as e:
+            self._log.error("%s: unable to save %d buffered items to %s: %s" % (self.name, len(items), filename, e))
+        else:
+            self._log.info("%s: saved %d buffered items to %s" % (self.name, len(items), filename))
+
+    def restore(self, path):
+        """Load the buffered items saved by persist(), if any."""
+
+        if not path:
+            return
+        filename = self._persist_file(path)
+        try:
+            with open(filename) as f:
+                items = json.load(f)
+            os.remove(filename)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self._log.error("%s: unable to load buffered items from %s: %s" % (self.name, filename, e))
+            return
+        for item in items:
+            self.buffer.storeItem(item)
+        self._log.info("%s: loaded %d buffered items from %s" % (self.name, len(items), filename))
 
     def set(self, **kwargs):
         """Set configuration parameters.
@@ -609,6 +812,22 @@ class EmonHubInterfacer(threading.Thread):
                 setting = str(setting).lower() == "true"
             elif key == 'targeted' and str(setting).lower() in ['true', 'false']:
                 setting = str(setting).lower() == "true"
+            elif key == 'rawbytes' and str(setting).lower() in ['true', 'false']:
+                setting = str(setting).lower() == "true"
+            elif key == 'channelsize' and self._valid_channel_setting(setting, str.isdigit):
+                pass
+            elif key == 'channeloverflow' and self._valid_channel_setting(setting, lambda v: v in ehch.OVERFLOW_POLICIES):
+                pass
+            elif key == 'buffer_type' and str(setting) in ehb.bufferMethodMap:
+                pass
+            elif key == 'buffer_size' and str(setting).isdigit() and int(setting) > 0:
+                pass
+            elif key == 'buffer_bytes' and str(setting).isdigit():
+                pass
+            elif key == 'buffer_path' and isinstance(setting, str):
+                pass
+            elif key == 'buffer_overflow' and str(setting) in ehb.OVERFLOW_POLICIES:
+                pass
             elif key == 'pubchannels':
                 pass
             elif key == 'subchannels':
@@ -619,6 +838,111 @@ class EmonHubInterfacer(threading.Thread):
             self._settings[key] = setting
             self._log.debug("Setting " + self.name + " " + key + ": " + str(setting))
 
+        # Apply channel settings to the existing channels
+        for channel in list(self._pub_channels.values()):
+            self._configure_channel(channel)
+        for channel in list(self._sub_channels.values()):
+            self._configure_channel(channel, self._add_item)
+
+        self._configure_buffer()
+
+    def _configure_buffer(self):
+        """Apply the buffer settings.
+
+        buffer_type: 'memory' (default), 'compact', 'sqlite', 'mmap' or 'tiered',
+        see ehb.bufferMethodMap
+        buffer_size: maximum number of items
+        buffer_bytes: maximum size of the items in bytes, 0 for no limit
+        buffer_path: directory of the files of the persistent buffers, see
+        ehb.DEFAULT_PATH
+        buffer_overflow: what to do with the oldest items when full, see
+        ehb.OVERFLOW_POLICIES
+
+        If the type or path change, a new buffer is created and the buffered
+        items are moved to it. Until the interfacer takes over from the one
+        it replaces, see take_over, the buffer is left as it is.
+
+        """
+
+        config = (str(self._settings['buffer_type']), int(self._settings['buffer_size']),
+                  int(self._settings['buffer_bytes']), self._settings['buffer_path'] or None,
+                  str(self._settings['buffer_overflow']))
+        if config == self._buffer_config or (self.buffer is not None and self._predecessor is not None):
+            return
+        buffer_type, buffer_size, buffer_bytes, path, overflow = config
+
+        old = self.buffer
+        if old is not None and (buffer_type, path) == (self._buffer_config[0], self._buffer_config[3]):
+            # Same storage, new limits
+            old.setLimits(buffer_size, buffer_bytes, overflow)
+            self._buffer_config = config
+            return
+
+        try:
+            buffer = ehb.getBuffer(buffer_type)(self.name, buffer_size, path, buffer_bytes)
+        except Exception as e:
+            self._log.error("%s: unable to create %s buffer: %s" % (self.name, buffer_type, e))
+            if old is not None:
+                return
+            buffer_type, path = 'memory', None
+            config = (buffer_type, buffer_size, buffer_bytes, path, overflow)
+            buffer = ehb.getBuffer(buffer_type)(self.name, buffer_size, path, buffer_bytes)
+        buffer.setLimits(buffer_size, buffer_bytes, overflow)
+        self._buffer_config = config
+        if old is None:
+            self.buffer = buffer
+            return
+
+        # Move the buffered items, then those stored in the meantime
+        buffer.copyDownsampling(old)
+        moved = self._move_items(old, buffer)
+        self.buffer = buffer
+        if moved:
+            self._move_items(old, buffer)
+        old.close()
+        self._log.info("%s: using a %s buffer, %d buffered items" % (self.name, buffer_type, buffer.size()))
+
+    def _move_items(self, source, dest):
+        """Move the items of the buffer source to dest, return False if some
+        could not be.
+
+        If the source fails to give or discard items, eg on a database error,
+        the items left stay in it: on disk for a persistent buffer, to be sent
+        once it is used again, lost otherwise. Items are only stored in dest
+        once discarded from the source, so that none is sent twice.
+
+        """
+
+        while source.hasItems():
+            size = source.size()
+            items = source.retrieveItems(self._item_limit)
+            if items:
+                source.discardLastRetrievedItems(len(items))
+            if not items or source.size() >= size:
+                if source.persistent:
+                    self._log.error("%s: unable to move buffered items, %d left in the previous buffer until it is used again"
+                                    % (self.name, source.size()))
+                else:
+                    self._log.error("%s: unable to move buffered items, %d lost" % (self.name, source.size()))
+                source.commit()
+                return False
+            dest.storeItems(items)
+        source.commit()
+        return True
+
+    def _valid_channel_setting(self, setting, valid):
+        """Check each value of a per channel setting with the valid function."""
+
+        if not isinstance(setting, (list, tuple)):
+            setting = [setting]
+        for item in setting:
+            item = str(item).strip()
+            if ':' in item:
+                item = item.rsplit(':', 1)[1].strip()
+            if not valid(item):
+                return False
+        return True
+
 
 """class EmonHubInterfacerInitError
 
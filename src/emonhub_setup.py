@@ -7,11 +7,24 @@
 
 """
 
+import os
 import time
+import struct
+import hashlib
 import logging
 import json
 from configobj import ConfigObj
 
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.inotify_init1
+    _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    inotify_found = True
+except (ImportError, OSError, AttributeError):
+    inotify_found = False
+
 """class EmonHubSetup
 
 User interface to setup the hub.
@@ -35,7 +48,8 @@ The run() method is supposed to be run regularly by the instantiater, to
 perform regular communication tasks.
 
 The check_settings() method is run regularly as well. It checks the settings
-and returns True is settings were changed.
+and returns True is settings were changed, or the set of changed sections as
+('hub',), ('nodes',) or ('interfacers', name) tuples.
 
 This almost empty class is meant to be inherited by subclasses specific to
 each setup.
@@ -79,6 +93,9 @@ class EmonHubFileSetup(EmonHubSetup):
 
         # Initialize update timestamp
         self._settings_update_timestamp = 0
+
+        # The file is only parsed again when it has actually changed
+        self._watcher = EmonHubFileWatcher(filename)
         self._retry_time_interval = 5
 
         # create a timeout message if time out is set (>0)
@@ -99,6 +116,9 @@ class EmonHubFileSetup(EmonHubSetup):
             # Check the settings file sections
             self.settings['hub']
             self.settings['interfacers']
+
+            # Settings last returned, a failed reload doesn't count
+            self._applied_settings = dict(self.settings)
         except IOError as e:
             raise EmonHubSetupInitError(e)
         except SyntaxError as e:
@@ -111,7 +131,8 @@ class EmonHubFileSetup(EmonHubSetup):
     def check_settings(self):
         """Check settings
 
-        Update attribute settings and return True if modified.
+        Update attribute settings and return the set of changed sections if
+        modified, eg {('nodes',), ('interfacers', 'emoncmsorg')}.
 
         """
 
@@ -122,8 +143,8 @@ class EmonHubFileSetup(EmonHubSetup):
         # Update timestamp
         self._settings_update_timestamp = now
 
-        # Backup settings
-        settings = dict(self.settings)
+        if not self._watcher.changed():
+            return
 
         # Get settings from file
         try:
@@ -136,20 +157,24 @@ class EmonHubFileSetup(EmonHubSetup):
         except IOError as e:
             self._log.warning('Could not get settings: ' + str(e) + self.retry_msg)
             self._settings_update_timestamp = now + self._retry_time_interval
+            self._watcher.invalidate()
             return
         except SyntaxError as e:
             self._log.warning('Could not get settings: ' +
                               'Error parsing config file: ' + str(e) + self.retry_msg)
             self._settings_update_timestamp = now + self._retry_time_interval
+            self._watcher.invalidate()
             return
         except Exception:
             import traceback
             self._log.warning("Couldn't get settings, Exception: " +
                               traceback.format_exc() + self.retry_msg)
             self._settings_update_timestamp = now + self._retry_time_interval
+            self._watcher.invalidate()
             return
 
-        if self.settings != settings:
+        changed = self._changed_sections(self._applied_settings, self.settings)
+        if changed:
             # Check the settings file sections
             try:
                 self.settings['hub']
@@ -157,7 +182,160 @@ class EmonHubFileSetup(EmonHubSetup):
             except KeyError as e:
                 self._log.warning("Configuration file missing section: " + str(e))
             else:
+                self._applied_settings = dict(self.settings)
+                return changed
+
+    @staticmethod
+    def _changed_sections(old, new):
+        """Return the set of sections differing between two settings trees."""
+
+        changed = set()
+        for section in set(old) | set(new):
+            if section != 'interfacers' and old.get(section) != new.get(section):
+                changed.add((section,))
+        old_interfacers = old.get('interfacers') or {}
+        new_interfacers = new.get('interfacers') or {}
+        for name in set(old_interfacers) | set(new_interfacers):
+            if old_interfacers.get(name) != new_interfacers.get(name):
+                changed.add(('interfacers', name))
+        return changed
+
+
+"""class EmonHubFileWatcher
+
+Tells whether a file's content has changed since last checked, without
+reading it every time.
+
+Uses inotify on Linux, watching the file's directory so that files replaced
+by editors (written to a temporary file, then renamed) are still followed.
+Falls back to comparing the file's modification time and size otherwise.
+Either way the content hash is then compared, so that saving an unchanged
+file or touching it does not count as a change.
+
+"""
+
+class EmonHubFileWatcher:
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    _event = struct.Struct('iIII')
+
+    def __init__(self, filename):
+        self._log = logging.getLogger("EmonHub")
+        self._path = os.path.abspath(filename)
+        self._dir, self._name = os.path.split(self._path)
+        self._name = os.fsencode(self._name)
+
+        self._stat = self._get_stat()
+        self._hash = self._get_hash()
+        # Set when the content has to be checked regardless of events
+        self._pending = False
+
+        self._fd = -1
+        if inotify_found:
+            self._open_inotify()
+
+    def _open_inotify(self):
+        mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM
+                | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE)
+        fd = _libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            self._log.debug("inotify unavailable, polling " + self._path)
+            return
+        if _libc.inotify_add_watch(fd, os.fsencode(self._dir), mask) < 0:
+            self._log.debug("Unable to watch " + self._dir + ", polling " + self._path)
+            os.close(fd)
+            return
+        self._fd = fd
+
+    def _get_stat(self):
+        try:
+            st = os.stat(self._path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _get_hash(self):
+        try:
+            with open(self._path, 'rb') as f:
+                return hashlib.sha1(f.read()).digest()
+        except OSError:
+            return None
+
+    def _read_events(self):
+        """Return True if any pending inotify event concerns the file."""
+
+        touched = False
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return touched
+            except OSError:
+                data = b''
+            if not data:
+                # Watch lost, poll from now on
+                self.close()
                 return True
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self._event.unpack_from(data, offset)
+                offset += self._event.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & self.IN_IGNORED:
+                    # The directory itself is gone
+                    self.close()
+                    return True
+                if mask & self.IN_Q_OVERFLOW or name == self._name:
+                    touched = True
+
+    def changed(self):
+        """Return True if the file content changed since last call."""
+
+        if self._fd >= 0:
+            touched = self._read_events()
+            # The stat is kept up to date in case inotify is lost
+            if touched:
+                self._stat = self._get_stat()
+        else:
+            stat = self._get_stat()
+            touched = stat != self._stat
+            self._stat = stat
+
+        if not touched and not self._pending:
+            return False
+        self._pending = False
+
+        digest = self._get_hash()
+        if digest == self._hash:
+            return False
+        self._hash = digest
+        return True
+
+    def invalidate(self):
+        """Make the next changed() call check and report the content."""
+        self._hash = None
+        self._pending = True
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __del__(self):
+        self.close()
+
 
 """class EmonHubSetupInitError
 
@@ -0,0 +1,376 @@
+"""
+
+  This code is released under the GNU Affero General Public License.
+
+  OpenEnergyMonitor project:
+  http://openenergymonitor.org
+
+"""
+
+import time
+import pickle
+import logging
+import importlib
+import threading
+import traceback
+import multiprocessing
+
+import emonhub_coder as ehc
+import emonhub_interfacer as ehi
+from emonhub_interfacer import EmonHubInterfacer
+
+"""
+Process sharding
+
+Interfacers configured with a 'process' name run in a worker process of
+that name instead of in the hub process, so that a CPU heavy interfacer
+doesn't hold the GIL at the expense of all the others:
+
+    [[SMASolar]]
+        Type = EmonHubSMASolarInterfacer
+        process = solar
+        [[[init_settings]]]
+        ...
+
+The hub keeps routing and supervision. Each sharded interfacer is
+represented in the hub by an EmonHubProcessInterfacer proxy, which has the
+same pub and sub channels. An interfacer rebuilt with the same name is
+replaced in the worker, taking its predecessor's buffer and connections
+over, uid tells the successive proxies apart. Messages are exchanged with the worker over a
+pipe as pickled tuples:
+
+    hub -> worker   ('create', name, uid, Type, init_settings, runtimesettings)
+                    ('set', name, runtimesettings)
+                    ('delete', name, uid)
+                    ('cargo', name, channel, cargo)
+                    ('nodes', nodelist)
+                    ('loglevel', level)
+                    ('drain', name)
+                    ('exit', deadline, persist_path)
+    worker -> hub   ('cargo', name, channel, cargo)
+                    ('dead', name, reason)
+                    ('log', level, message)
+
+"""
+
+
+def _pack(msg):
+    return pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+
+
+def _unpack(data):
+    return pickle.loads(data)
+
+
+"""class EmonHubWorker
+
+Hub side of a worker process hosting a group of interfacers.
+
+"""
+
+class EmonHubWorker:
+
+    def __init__(self, group, loglevel=logging.WARNING, persist_path=None):
+        self.group = group
+        self._log = logging.getLogger("EmonHub")
+        self._proxies = {}
+        self._send_lock = threading.Lock()
+        self._exiting = False
+
+        # spawn rather than fork, the hub has many threads running
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=worker_main, args=(group, child_conn, loglevel, persist_path),
+                                    name="emonhub-" + group, daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._log.info("Started worker process '%s' (pid %d)" % (group, self._process.pid))
+
+        self._reader = threading.Thread(target=self._read_loop, name="worker-" + group, daemon=True)
+        self._reader.start()
+
+    def is_alive(self):
+        return self._process.is_alive() and self._reader.is_alive()
+
+    def send(self, *msg):
+        """Send a message to the worker, return False if it is gone."""
+        try:
+            with self._send_lock:
+                self._conn.send_bytes(_pack(msg))
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def attach(self, proxy):
+        self._proxies[proxy.name] = proxy
+
+    def detach(self, proxy):
+        if self._proxies.get(proxy.name) is proxy:
+            del self._proxies[proxy.name]
+
+    def _read_loop(self):
+        """Dispatch the messages received from the worker process."""
+
+        while True:
+            try:
+                msg = _unpack(self._conn.recv_bytes())
+            except (EOFError, OSError):
+                break
+            except Exception:
+                self._log.warning("Worker '%s' sent an invalid message: %s" % (self.group, traceback.format_exc()))
+                continue
+
+            if msg[0] == 'cargo':
+                proxy = self._proxies.get(msg[1])
+                if proxy is not None:
+                    proxy._get_pub_channel(msg[2]).put(msg[3])
+            elif msg[0] == 'log':
+                self._log.log(msg[1], "[" + self.group + "] " + msg[2])
+            elif msg[0] == 'dead':
+                self._log.warning("Interfacer '%s' failed in worker '%s': %s" % (msg[1], self.group, msg[2]))
+                proxy = self._proxies.get(msg[1])
+                if proxy is not None:
+                    proxy.stop = True
+
+        if self._exiting:
+            self._log.info("Worker process '%s' exited" % self.group)
+            return
+
+        # The worker process is gone, the hub restarts its interfacers
+        self._log.warning("Worker process '%s' exited" % self.group)
+        for proxy in list(self._proxies.values()):
+            proxy.stop = True
+
+    def shutdown(self, deadline, persist_path=None):
+        """Ask the worker process to shut its interfacers down and exit.
+
+        deadline (float): time.time() value by which to be done flushing
+        persist_path (string): directory where to save what is left
+
+        """
+
+        self._exiting = True
+        self.send('exit', deadline, persist_path)
+
+    def close(self, timeout=5):
+        """Wait for the worker process to exit, kill it if it doesn't."""
+
+        if not self._exiting:
+            self.shutdown(time.time() + timeout)
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._log.warning("Worker process '%s' did not exit, terminating" % self.group)
+            self._process.terminate()
+            self._process.join(1)
+        self._conn.close()
+
+
+"""class EmonHubProcessInterfacer
+
+Stands in the hub for an interfacer running in a worker process: cargo
+routed to its sub channels is forwarded to the worker, cargo published by
+the worker comes out of its pub channels.
+
+"""
+
+class EmonHubProcessInterfacer(EmonHubInterfacer):
+
+    def __init__(self, name, worker, interfacer_type, init_settings):
+        super().__init__(name)
+
+        self._worker = worker
+        self._type = interfacer_type
+        self._init_settings = dict(init_settings)
+        self._runtimesettings = {}
+        self._created = False
+
+    def set(self, **kwargs):
+        # Keep the channel settings here for routing, the rest is for the worker
+        super().set(**kwargs)
+        self._runtimesettings = dict(kwargs)
+        if self._created:
+            self._worker.send('set', self.name, self._runtimesettings)
+
+    def start(self):
+        self._worker.attach(self)
+        self._created = self._worker.send('create', self.name, id(self), self._type,
+                                          self._init_settings, self._runtimesettings)
+        super().start()
+
+    def run(self):
+        """Forward the cargo routed to the sub channels to the worker"""
+
+        while not self.stop:
+            for channel in self._settings["subchannels"]:
+                if channel in self._sub_channels:
+                    for cargo in self._sub_channels[channel].get_all():
+                        self._worker.send('cargo', self.name, channel, cargo)
+            if self._wakeup.wait(1):
+                self._wakeup.clear()
+
+    def _configure_buffer(self):
+        # The worker has the buffer, this one stays an empty memory buffer
+        if self.buffer is None:
+            super()._configure_buffer()
+
+    def _add_item(self, item):
+        # Spilled from a full sub channel, the worker has the buffer
+        if self._settings["subchannels"]:
+            self._worker.send('cargo', self.name, self._settings["subchannels"][0], item)
+
+    def close(self):
+        # Ignored by the worker if a successor has been created since
+        self._worker.send('delete', self.name, id(self))
+        self._worker.detach(self)
+
+    def drain(self):
+        self._worker.send('drain', self.name)
+
+    def shutdown(self, deadline, path=None):
+        """Forward the cargo left, the worker flushes and persists on exit."""
+
+        for channel in self._settings["subchannels"]:
+            if channel in self._sub_channels:
+                for cargo in self._sub_channels[channel].get_all():
+                    self._worker.send('cargo', self.name, channel, cargo)
+
+    def restore(self, path):
+        # Done by the interfacer in the worker
+        pass
+
+
+"""
+Worker process side
+
+"""
+
+class _PipeLogHandler(logging.Handler):
+    """Send the worker's log records to the hub"""
+
+    def __init__(self, send):
+        super().__init__()
+        self._send = send
+        self.setFormatter(logging.Formatter('%(threadName)-10s %(message)s'))
+
+    def emit(self, record):
+        try:
+            self._send('log', record.levelno, self.format(record))
+        except Exception:
+            pass
+
+
+def worker_main(group, conn, loglevel, persist_path=None):
+    """Entry point of a worker process"""
+
+    send_lock = threading.Lock()
+
+    def send(*msg):
+        with send_lock:
+            conn.send_bytes(_pack(msg))
+
+    log = logging.getLogger("EmonHub")
+    log.addHandler(_PipeLogHandler(send))
+    log.setLevel(loglevel)
+
+    interfacers = {}
+    uids = {}
+    wakeup = threading.Event()
+    exiting = threading.Event()
+
+    def route():
+        """Forward published cargo to the hub, report dead interfacers"""
+        reported = set()
+        while not exiting.is_set():
+            if wakeup.wait(1):
+                wakeup.clear()
+            for name, I in list(interfacers.items()):
+                for channel in I._settings['pubchannels']:
+                    if channel in I._pub_channels:
+                        for cargo in I._pub_channels[channel].get_all():
+                            send('cargo', name, channel, cargo)
+                if not I.is_alive() and I not in reported:
+                    reported.add(I)
+                    send('dead', name, "thread is dead")
+
+    def delete(name, timeout=10):
+        """Stop an interfacer, return it to be closed or handed over"""
+        I = interfacers.pop(name, None)
+        uids.pop(name, None)
+        if I is not None:
+            if not I.is_alive():
+                I._reusable = False
+            I.stop = True
+            I.join(timeout)
+            if I.is_alive():
+                I._reusable = False
+        return I
+
+    router = threading.Thread(target=route, name="router", daemon=True)
+    router.start()
+
+    while True:
+        try:
+            msg = _unpack(conn.recv_bytes())
+        except (EOFError, OSError):
+            # Hub is gone
+            deadline, persist_path = time.time() + 5, None
+            break
+
+        try:
+            if msg[0] == 'cargo':
+                I = interfacers.get(msg[1])
+                if I is not None:
+                    I._get_sub_channel(msg[2]).put(msg[3])
+            elif msg[0] == 'create':
+                name, uid, interfacer_type, init_settings, runtimesettings = msg[1:]
+                old = delete(name)
+                if old is not None:
+                    ehi.handover[name] = old
+                try:
+                    module = importlib.import_module('interfacers.' + interfacer_type)
+                    I = getattr(module, interfacer_type)(name, **init_settings)
+                    I.set(**runtimesettings)
+                    I.init_settings = init_settings
+                    I._pub_wakeup = wakeup
+                    I.take_over()
+                    I.restore(persist_path)
+                    I.start()
+                except Exception as e:
+                    send('dead', name, "unable to create interfacer: " + str(e))
+                else:
+                    interfacers[name] = I
+                    uids[name] = uid
+                    log.info("Created " + interfacer_type + " '" + name + "'")
+                finally:
+                    if old is not None:
+                        ehi.handover.pop(name, None)
+                        old.close()
+            elif msg[0] == 'set':
+                if msg[1] in interfacers:
+                    interfacers[msg[1]].set(**msg[2])
+            elif msg[0] == 'delete':
+                if uids.get(msg[1]) == msg[2]:
+                    delete(msg[1]).close()
+            elif msg[0] == 'nodes':
+                ehc.load_nodes(msg[1])
+            elif msg[0] == 'loglevel':
+                log.setLevel(msg[1])
+            elif msg[0] == 'drain':
+                if msg[1] in interfacers:
+                    interfacers[msg[1]].drain()
+            elif msg[0] == 'exit':
+                deadline, persist_path = msg[1], msg[2]
+                break
+        except Exception:
+            log.warning("Worker failed to process message " + str(msg[0]) + ": " + traceback.format_exc())
+
+    # Shut down like the hub does: stop reading, stop, flush and persist
+    exiting.set()
+    for I in interfacers.values():
+        I.drain()
+    for name in list(interfacers):
+        I = delete(name, max(deadline - time.time(), 0))
+        if I.is_alive():
+            log.warning(name + " did not stop in time, its buffer is lost")
+            continue
+        I.shutdown(deadline, persist_path)
@@ -17,7 +17,12 @@ class EmonHiokiTcpInterfacer(EmonHubInterfacer):
     # Initialization
     def __init__(self, name, IP="192.168.1.11", port=8802):
         super().__init__(name)
-        self._con = self._open_socket(IP,port)
+        # reuse the socket opened before a settings reload, if any
+        self._con = self._inherit('_con', (IP, port))
+        if self._con is not None:
+            self._sopen = True
+        else:
+            self._con = self._open_socket(IP,port)
         self._rNames = []
         if self._sopen :
             self._log.info("socket opened on HIOKI datalogger :-)")
@@ -26,32 +31,22 @@ class EmonHiokiTcpInterfacer(EmonHubInterfacer):
 
     # config check given a suffix (name,channel,voice)
     def _check(self,node,suffix):
-        # ehc.nodelist is a json object containing all datas from the [nodes] section of the emonhub.conf file
-        if ehc.nodelist[node]['rx'] is None:
+        # ehc.nodes holds the settings of the [nodes] section of the emonhub.conf file, checked when loaded
+        conf = ehc.nodes.get(node)
+        if conf is None or conf.rx is None:
           self._log.error("!!!!!!!!!!!!!!!!!!!!!missing rx section in the node")
           return []
-        else:
-          rx=ehc.nodelist[node]['rx']
-        if suffix+'s' in rx:
-            what = rx[suffix+'s']
-        elif suffix in rx:
-            what = rx[suffix]
-        else:
+        result = list(conf.rx.values(suffix))
+        if not result:
             self._log.error("please provide a "+suffix+" or a list of "+suffix+"s")
             self._sopen=False
-            return []
-        result=[]
-        if type(what) is list:
-            result = what
-        else:
-            result.append(str(what))
         return result
 
     # Close connection
     def close(self):
         if self._con is not None:
             self._log.debug("Closing socket on HIOKI")
-            self._con.close
+            self._con.close()
 
     # read the runtime_settings from the interfacer section and store them in self._settings
     # they are  pubchannels, nodeId(s), interval
@@ -13,8 +13,11 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
         # add or alter any default settings for this reporter
         # defaults previously defined in inherited emonhub_interfacer
         # here we are just changing the batchsize from 1 to 100
-        # and the interval from 0 to 30
-        self._defaults.update({'batchsize': 100, 'interval': 30})
+        # and the interval from 0 to 30, cargo that doesn't fit in a full
+        # sub channel goes straight to the (large) buffer, which holds
+        # the frames packed
+        self._defaults.update({'batchsize': 100, 'interval': 30, 'channeloverflow': 'spill-to-buffer',
+                               'buffer_type': 'compact', 'buffer_size': '100000'})
         # This line will stop the default values printing to logfile at start-up
         self._settings.update(self._defaults)
 
@@ -29,9 +32,6 @@ class EmonHubEmoncmsHTTPInterfacer(EmonHubInterfacer):
         # set an absolute upper limit for number of items to process per post
         self._item_limit = 250
 
-        # maximum buffer size
-        self.buffer._maximumEntriesInBuffer = 100000
-
     def _process_post(self, databuffer):
         """Send data to server."""
 
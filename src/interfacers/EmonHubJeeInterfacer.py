@@ -27,10 +27,10 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
         if self._ser is not None:
             self._ser.write(b"v")
             time.sleep(2)  # FIXME sleep in initialiser smells
-            self._rx_buf = self._rx_buf + self._ser.readline().decode()
-            if '\r\n' in self._rx_buf:
-                self._rx_buf = ""
-                info = self._rx_buf + self._ser.readline().decode()[:-2]
+            self._rx_buf = self._rx_buf + self._ser.readline()
+            if b'\r\n' in self._rx_buf:
+                self._rx_buf = b""
+                info = self._ser.readline().decode()[:-2]
                 if info != "":
                     # Split the returned "info" string into firmware version & current settings
                     self.info[0] = info.strip().split(' ')[0]
@@ -43,7 +43,7 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
                     self._log.info(self.name + " device firmware version & configuration: not available")
             else:
                 self._log.warning("Device communication error - check settings")
-        self._rx_buf = ""
+        self._rx_buf = b""
         self._ser.flushInput()
 
         # Initialize settings
@@ -71,7 +71,8 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
 
         #just send it
         txc = self._process_tx(cargo)
-        self.send(txc)
+        if txc:
+            self.send(txc)
 
     def read(self):
         """Read data from serial port and process if complete line received.
@@ -81,20 +82,27 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
         """
 
         # Read serial RX
-        try:
-            self._rx_buf = self._rx_buf + self._ser.readline().decode()
-        except UnicodeDecodeError:
-            return
-            
+        self._rx_buf = self._rx_buf + self._ser.readline()
+
         # If line incomplete, exit
-        if '\r\n' not in self._rx_buf:
+        if b'\r\n' not in self._rx_buf:
             return
 
         # Remove CR,LF.
         f = self._rx_buf[:-2].strip()
 
         # Reset buffer
-        self._rx_buf = ''
+        self._rx_buf = b''
+
+        # With the 'rawbytes' setting, data frames ('OK 10 ...' or '10 ...')
+        # are kept as bytes, anything else is checked as text
+        if self._settings['rawbytes'] and (f[:1].isdigit() or f[:3] == b'OK '):
+            return self._read_frame(f)
+
+        try:
+            f = f.decode()
+        except UnicodeDecodeError:
+            return
 
         if not f:
             return
@@ -121,18 +129,23 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
             self._log.debug("device settings updated: " + str(self.info[1]))
             return
 
+        return self._read_frame(f)
+
+    def _read_frame(self, f):
+        """Return the cargo of a data frame, str or bytes."""
+
         # Save raw packet to new cargo object
         c = Cargo.new_cargo(rawdata=f)
 
         # Convert single string to list of string values
-        f = f.split(' ')
+        f = f.split(b' ' if isinstance(f, bytes) else ' ')
 
         # Strip leading 'OK' from frame if needed
-        if f[0] == 'OK':
+        if f[0] in ('OK', b'OK'):
             f = f[1:]
 
         # Extract RSSI value if it's available
-        if f[-1].startswith('(') and f[-1].endswith(')'):
+        if f[-1][:1] in ('(', b'(') and f[-1][-1:] in (')', b')'):
             r = f[-1][1:-1]
             try:
                 c.rssi = int(r)
@@ -147,6 +160,10 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
         except ValueError:
             return
 
+        if self._settings['rawbytes']:
+            c.realdata = self._rx_values(f[1:])
+            return c
+
         try:
             # Store data as a list of integer values
             c.realdata = [int(i) for i in f[1:]]
@@ -223,6 +240,13 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
                 self._log.debug(self.name + " broadcasting time: %02d:%02d" % (now.hour, now.minute))
                 self._ser.write(b"00,%02d,%02d,00,s" % (now.hour, now.minute))
 
+    def _action_timeout(self):
+        """Wake up in time to broadcast the time, if enabled"""
+
+        interval = int(self._settings['interval'])
+        if interval:
+            return max(self._interval_timestamp + interval - time.time(), 0)
+
     def _process_post(self, databuffer):
         """Send data to server/broker or other output
 
@@ -237,19 +261,18 @@ class EmonHubJeeInterfacer(ehi.EmonHubSerialInterfacer):
         f = cargo
         cmd = "s"
 
-        if self.getName() in f.encoded:
-            data = f.encoded[self.getName()]
+        if self.name in f.encoded:
+            data = f.encoded[self.name]
         else:
             data = f.realdata
 
-        payload = ""
-        for value in data:
-            if not 0 < int(value) < 255:
+        values = [int(value) for value in data]
+        for value in values:
+            if not 0 < value < 255:
                 self._log.warning(self.name + " discarding Tx packet: values out of scope")
                 return
-            payload += str(int(value)) + ","
 
-        payload += cmd
+        payload = ",".join(map(str, values)) + "," + cmd
 
         self._log.debug(str(f.uri) + " sent TX packet: " + payload)
         self._ser.write(payload.encode())
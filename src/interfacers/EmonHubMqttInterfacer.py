@@ -39,14 +39,24 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
             'mqtt_passwd': mqtt_passwd
         })
 
-        self._connected = False
+        # reuse the client connected before a settings reload, if any
+        self._mqttc = self._inherit('_mqttc', (mqtt_host, mqtt_port, mqtt_user, mqtt_passwd))
+        if self._mqttc is None:
+            self._mqttc = mqtt.Client()
+        self._connected = self._mqttc.is_connected()
 
-        self._mqttc = mqtt.Client()
         self._mqttc.on_connect = self.on_connect
         self._mqttc.on_disconnect = self.on_disconnect
         self._mqttc.on_message = self.on_message
         self._mqttc.on_subscribe = self.on_subscribe
 
+    def close(self):
+        """Disconnect from the broker"""
+
+        if self._mqttc is not None and self._connected:
+            self._log.debug("Disconnecting from MQTT broker")
+            self._mqttc.disconnect()
+
     def add(self, cargo):
         """Append data to buffer.
 
@@ -178,6 +188,28 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
             # Then attempt to flush the buffer
             self.flush()
 
+    def _wait_fds(self):
+        """Sleep until the broker sends something, messages are read by action()"""
+
+        sock = self._mqttc.socket()
+        if sock is not None:
+            return [sock]
+
+    def _wait(self):
+        """Messages are received by action(), wait on the MQTT socket even
+        when not publishing to any channel, read() is never polled"""
+
+        if self._wakeup.wait(self._action_timeout(), self._wait_fds() or []):
+            self._wakeup.clear()
+
+    def _action_timeout(self):
+        """Call the MQTT client loop at least once a second for keepalives"""
+
+        timeout = super()._action_timeout()
+        if timeout is None:
+            return 1.0
+        return min(timeout, 1.0)
+
     def on_connect(self, client, userdata, flags, rc):
 
         connack_string = {0: 'Connection successful',
@@ -221,16 +253,7 @@ class EmonHubMqttInterfacer(EmonHubInterfacer):
             if rxc:
                 # rxc = self._process_tx(rxc)
                 if rxc:
-                    for channel in self._settings["pubchannels"]:
-
-                        # Initialize channel if needed
-                        if channel not in self._pub_channels:
-                            self._pub_channels[channel] = []
-
-                        # Add cargo item to channel
-                        self._pub_channels[channel].append(rxc)
-
-                        self._log.debug(str(rxc.uri) + " Sent to channel' : " + str(channel))
+                    self._publish(rxc)
 
     def set(self, **kwargs):
         """
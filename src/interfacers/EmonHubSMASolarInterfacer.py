@@ -274,11 +274,13 @@ class EmonHubSMASolarInterfacer(EmonHubInterfacer):
             c = Cargo.new_cargo()
             c.rawdata = None
             #Sort the output to keep the keys in a consistent order
-            c.names = []
-            c.realdata = []
+            names = []
+            values = []
             for key in sorted(output):
-                c.names.append(output[key].Label)
-                c.realdata.append(output[key].Value)
+                names.append(output[key].Label)
+                values.append(output[key].Value)
+            c.names = names
+            c.realdata = values
 
             #TODO: We need to revisit this once we know how multiple inverters communicate with us
             c.nodeid = inverter["NodeId"]
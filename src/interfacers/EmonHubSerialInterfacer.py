@@ -21,11 +21,13 @@ class EmonHubSerialInterfacer(EmonHubInterfacer):
         # Initialization
         super().__init__(name)
 
-        # Open serial port
-        self._ser = self._open_serial_port(com_port, com_baud)
+        # Open serial port, unless still open from before a settings reload
+        self._ser = self._inherit('_ser', (com_port, com_baud))
+        if self._ser is None:
+            self._ser = self._open_serial_port(com_port, com_baud)
 
         # Initialize RX buffer
-        self._rx_buf = ''
+        self._rx_buf = b''
 
     def close(self):
         """Close serial port"""
@@ -55,6 +57,12 @@ class EmonHubSerialInterfacer(EmonHubInterfacer):
             # raise EmonHubInterfacerInitError('Could not open COM port %s' % com_port)
         return s
 
+    def _wait_fds(self):
+        """Sleep until the serial port has data to read"""
+
+        if self._ser:
+            return [self._ser]
+
     def read(self):
         """Read data from serial port and process if complete line received.
 
@@ -66,17 +74,21 @@ class EmonHubSerialInterfacer(EmonHubInterfacer):
             return False
 
         # Read serial RX
-        self._rx_buf = self._rx_buf + self._ser.readline().decode()
+        self._rx_buf = self._rx_buf + self._ser.readline()
 
         # If line incomplete, exit
-        if '\r\n' not in self._rx_buf:
+        if b'\r\n' not in self._rx_buf:
             return
 
         # Remove CR,LF
         f = self._rx_buf[:-2]
 
         # Reset buffer
-        self._rx_buf = ''
+        self._rx_buf = b''
+
+        # Keep the line as bytes with the 'rawbytes' setting
+        if not self._settings['rawbytes']:
+            f = f.decode()
 
         # Create a Payload object
         c = Cargo.new_cargo(rawdata=f)
@@ -85,9 +97,9 @@ class EmonHubSerialInterfacer(EmonHubInterfacer):
 
         if int(self._settings['nodeoffset']):
             c.nodeid = int(self._settings['nodeoffset'])
-            c.realdata = f
+            c.realdata = self._rx_values(f)
         else:
             c.nodeid = int(f[0])
-            c.realdata = f[1:]
+            c.realdata = self._rx_values(f[1:])
 
         return c
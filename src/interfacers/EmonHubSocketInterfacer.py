@@ -25,11 +25,13 @@ class EmonHubSocketInterfacer(EmonHubInterfacer):
         self._skt_settings = {'apikey': ""}
         self._settings.update(self._skt_settings)
 
-        # Open socket
-        self._socket = self._open_socket(port_nb)
+        # Open socket, unless still open from before a settings reload
+        self._socket = self._inherit('_socket', (port_nb,))
+        if self._socket is None:
+            self._socket = self._open_socket(port_nb)
 
         # Initialize RX buffer for socket
-        self._sock_rx_buf = ''
+        self._sock_rx_buf = b''
 
     def _open_socket(self, port_nb):
         """Open a socket
@@ -57,6 +59,12 @@ class EmonHubSocketInterfacer(EmonHubInterfacer):
             self._log.debug('Closing socket')
             self._socket.close()
 
+    def _wait_fds(self):
+        """Sleep until a connection is made to the socket"""
+
+        if self._socket is not None:
+            return [self._socket]
+
     def read(self):
         """Read data from socket and process if complete line received.
 
@@ -75,39 +83,46 @@ class EmonHubSocketInterfacer(EmonHubInterfacer):
             conn, addr = self._socket.accept()
 
             # Read data
-            self._sock_rx_buf = self._sock_rx_buf + conn.recv(1024).decode("utf-8")
+            self._sock_rx_buf = self._sock_rx_buf + conn.recv(1024)
 
             # Close connection
             conn.close()
 
         # If there is at least one complete frame in the buffer
-        if '\r\n' not in self._sock_rx_buf:
+        if b'\r\n' not in self._sock_rx_buf:
             return
 
-        # Process and return first frame in buffer:
-        f, self._sock_rx_buf = self._sock_rx_buf.split('\r\n', 1)
+        # Process and return first frame in buffer, as bytes with the
+        # 'rawbytes' setting
+        f, self._sock_rx_buf = self._sock_rx_buf.split(b'\r\n', 1)
+        if not self._settings['rawbytes']:
+            f = f.decode("utf-8")
+        sep = b' ' if isinstance(f, bytes) else ' '
 
         # create a new cargo
         c = Cargo.new_cargo(rawdata=f)
 
         # Split string into values
-        f = f.split(' ')
+        f = f.split(sep)
 
         # If apikey is specified, 32chars and not all x's
         if 'apikey' in self._settings:
-            if len(self._settings['apikey']) == 32 and self._settings['apikey'].lower() != "x" * 32:
+            apikey = self._settings['apikey']
+            if len(apikey) == 32 and apikey.lower() != "x" * 32:
+                if isinstance(sep, bytes):
+                    apikey = apikey.encode()
                 # Discard if apikey is not in received frame
-                if self._settings['apikey'] not in f:
+                if apikey not in f:
                     self._log.warning(str(c.uri) + " discarded frame: apikey not matched")
                     return
                 # Otherwise remove apikey from frame
-                f = [v for v in f if self._settings['apikey'] not in v]
-                c.rawdata = ' '.join(f)
+                f = [v for v in f if apikey not in v]
+                c.rawdata = sep.join(f)
 
         # Extract timestamp value if one is expected or use 0
         timestamp = 0.0
         if self._settings['timestamped']:
-            c.timestamp = f[0]
+            c.timestamp = float(f[0])
             f = f[1:]
         # Extract source's node id
         c.nodeid = int(f[0]) + int(self._settings['nodeoffset'])
@@ -118,7 +133,7 @@ class EmonHubSocketInterfacer(EmonHubInterfacer):
             c.target = int(f[0])
             f = f[1:]
         # Extract list of data values
-        c.realdata = f#[1:]
+        c.realdata = self._rx_values(f)
         # Create a Payload object
         #f = new_cargo(data, node, timestamp, dest)
 
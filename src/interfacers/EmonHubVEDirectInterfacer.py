@@ -23,8 +23,10 @@ class EmonHubVEDirectInterfacer(EmonHubInterfacer):
         # Initialization
         super().__init__(name)
 
-        # Open serial port
-        self._ser = self._open_serial_port(com_port, com_baud)
+        # Open serial port, unless still open from before a settings reload
+        self._ser = self._inherit('_ser', (com_port, com_baud))
+        if self._ser is None:
+            self._ser = self._open_serial_port(com_port, com_baud)
 
         # Initialize RX buffer
         self._rx_buf = ''
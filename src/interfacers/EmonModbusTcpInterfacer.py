@@ -18,14 +18,6 @@ At this stage, only read_holding_registers() is implemented in the read() method
 for devices working only with integers, please change the function to read_inpu$
 """
 
-def clean(str):
-    if str.find(",")!=-1:
-        str=str[0:str.find(",")]
-    str=str.replace("[","")
-    str=str.replace("]","")
-    str=str.replace("'","")
-    return str
-
 class EmonModbusTcpInterfacer(EmonHubInterfacer):
 
     def __init__(self, name, modbus_IP='192.168.1.10', modbus_port=0):
@@ -42,7 +34,12 @@ class EmonModbusTcpInterfacer(EmonHubInterfacer):
         if pymodbus_found:
             self._log.info("pymodbus installed")
             self._log.debug("EmonModbusTcpInterfacer args: " + str(modbus_IP) + " - " + str(modbus_port))
-            self._con = self._open_modTCP(modbus_IP, modbus_port)
+            # reuse the connection opened before a settings reload, if any
+            self._con = self._inherit('_con', (modbus_IP, modbus_port))
+            if self._con is not None:
+                self._modcon = True
+            else:
+                self._con = self._open_modTCP(modbus_IP, modbus_port)
             if self._modcon:
                  self._log.info("Modbustcp client Connected")
             else:
@@ -81,7 +78,9 @@ class EmonModbusTcpInterfacer(EmonHubInterfacer):
     def _read_node(self,node):
         """ Read registers from client and create a cargo for the specified node"""
         if pymodbus_found:
-            f = []
+            # datacodes and values read, encoded at once after the last register
+            codes = []
+            values = []
             c = Cargo.new_cargo(rawdata="")
             # valid datacodes list and number of registers associated
             # in modbus protocol, one register is 16 bits or 2 bytes
@@ -95,33 +94,28 @@ class EmonModbusTcpInterfacer(EmonHubInterfacer):
             if self._modcon :
 
                 # check if node has a configuration
-                if node not in ehc.nodelist:
+                conf = ehc.nodes.get(node)
+                if conf is None:
                     self._log.error("node "+node+" not configured")
                     return
-                if 'rx' not in ehc.nodelist[node]:
+                if conf.error:
+                    self._log.error("invalid configuration of node "+node+": "+conf.error)
+                    return
+                if conf.rx is None:
                     self._log.error("no rx section in configuration of node "+node)
                     return
 
-                rx=ehc.nodelist[node]['rx']
+                rx = conf.rx
 
-                # store names
-                rNames = rx['names']
-                if 'names' in rx:
-                    rNames = rx['names']
-                elif 'name' in rx:
-                    rNames={}
-                    rNames[0] = clean(str(rx['name']))
-                else:
-                    print("please provide a name or a list of names")
+                # names
+                rNames = rx.values('name')
+                if not rNames:
+                    self._log.error("please provide a name or a list of names")
                     return
 
-                # fetch registers
-                if 'registers' in rx:
-                    registers = rx['registers']
-                elif 'register' in rx:
-                    registers = {}
-                    registers[0] = clean(str(rx['register']))
-                else:
+                # registers
+                registers = rx.values('register')
+                if not registers:
                     self._log.error("please provide a register number or a list of registers")
                     return
 
@@ -130,70 +124,38 @@ class EmonModbusTcpInterfacer(EmonHubInterfacer):
                     self._log.error("You have to define an equal number of registers and of names")
                     return
 
-                # fetch unitId or unitIds
-                unitIds = None
-                if 'unitIds' in rx:
-                    unitIds = rx['unitIds']
-                elif 'unitId' in rx:
-                    unitId = int(clean(str(rx['unitId'])))
-                else:
-                    unitId=1
-
-                # check if number of names and number of unitIds are the same
-                if unitIds is not None:
-                    if len(unitIds) != len(rNames):
-                        self._log.error("You are using unitIds. You have to define an equal number of UnitIds and of names")
-                        return
-
-                # fetch datacode or datacodes
-                datacodes = None
-                if 'datacodes' in rx:
-                    datacodes = rx['datacodes']
-                elif 'datacode' in rx:
-                    datacode = clean(str(rx['datacode']))
-                else:
-                    self._log.error("please provide a datacode or a list of datacodes")
+                # unitId or unitIds, slave 1 if none
+                unitIds = rx.unitIds
+                if unitIds is None:
+                    unitIds = (1 if rx.unitId is None else rx.unitId,) * len(rNames)
+                elif len(unitIds) != len(rNames):
+                    self._log.error("You are using unitIds. You have to define an equal number of UnitIds and of names")
                     return
 
-                # check if number of names and number of datacodes are the same
-                if datacodes is not None:
-                    if len(datacodes) != len(rNames):
-                        self._log.error("You are using datacodes. You have to define an equal number of datacodes and of names")
+                # datacode or datacodes
+                datacodes = rx.datacodes
+                if datacodes is None:
+                    if rx.datacode is None:
+                        self._log.error("please provide a datacode or a list of datacodes")
                         return
+                    datacodes = (rx.datacode,) * len(rNames)
+                elif len(datacodes) != len(rNames):
+                    self._log.error("You are using datacodes. You have to define an equal number of datacodes and of names")
+                    return
 
                 # calculate expected size in bytes and search for invalid datacode(s)
-                expectedSize = 0
-                if datacodes is not None:
-                    for code in datacodes:
-                        if code not in valid_datacodes:
-                            self._log.debug("-" * 46)
-                            self._log.debug("invalid datacode")
-                            self._log.debug("-" * 46)
-                            return
-                        else:
-                            expectedSize += valid_datacodes[code] * 2
-                else:
-                    if datacode not in valid_datacodes:
-                        self._log.debug("-" * 46)
-                        self._log.debug("invalid datacode")
-                        self._log.debug("-" * 46)
-                        return
-                    else:
-                        expectedSize = len(rNames) * valid_datacodes[datacode] * 2
+                if any(code not in valid_datacodes for code in datacodes):
+                    self._log.debug("-" * 46)
+                    self._log.debug("invalid datacode")
+                    self._log.debug("-" * 46)
+                    return
+                expectedSize = sum(valid_datacodes[code] * 2 for code in datacodes)
 
                 self._log.debug("expected bytes number after encoding: " + str(expectedSize))
 
                 # at this stage, we don't have any invalid datacode(s)
                 # so we can loop and read registers
-                for idx, rName in enumerate(rNames):
-                    register = int(registers[idx])
-
-                    if unitIds is not None:
-                        unitId = int(unitIds[idx])
-
-                    if datacodes is not None:
-                        datacode = datacodes[idx]
-
+                for rName, register, unitId, datacode in zip(rNames, registers, unitIds, datacodes):
                     self._log.debug("datacode " + datacode)
                     qty = valid_datacodes[datacode]
                     self._log.debug("reading register # :" + str(register) + ", qty #: " + str(qty) + ", unit #: " + str(unitId))
@@ -242,11 +204,11 @@ class EmonModbusTcpInterfacer(EmonHubInterfacer):
                                 return
                             else:
                                 self._log.debug("RSSI OK")
-                        t = ehc.encode(datacode,rValD)
-                        f = f + list(t)
-                        self._log.debug("Encoded value: " + str(t))
+                        codes.append(datacode)
+                        values.append(rValD)
                         self._log.debug("value: " + str(rValD))
 
+                f = list(ehc.encode_many(''.join(codes), values))
                 #test if payload length is OK
                 if len(f) == expectedSize:
                     self._log.debug("payload size OK (" + str(len(f)) + ")")
@@ -272,17 +234,7 @@ class EmonModbusTcpInterfacer(EmonHubInterfacer):
                     if rxc:
                         rxc = self._process_rx(rxc)
                         if rxc:
-                            for channel in self._settings["pubchannels"]:
-                                self._log.debug(str(rxc.uri) + " Sent to channel(start)' : " + str(channel))
-
-                                # Initialize channel if needed
-                                if not channel in self._pub_channels:
-                                    self._pub_channels[channel] = []
-
-                                # Add cargo item to channel
-                                self._pub_channels[channel].append(rxc)
-
-                                self._log.debug(str(rxc.uri) + " Sent to channel(end)' : " + str(channel))
+                            self._publish(rxc)
             self._log.debug("all modbus 'simili' nodes processed")
             return
         elif 'nodeId' in self._settings:
@@ -27,6 +27,8 @@ class EmonModbusTcpInterfacer2(EmonHubInterfacer):
 
         # Initialization
         super().__init__(name)
+        # nodes settings the node configs were checked against
+        self._nodes = ehc.nodes
         
         if not pymodbus_found:
             self._log.error("PYMODBUS NOT PRESENT BUT NEEDED !!")
@@ -34,7 +36,17 @@ class EmonModbusTcpInterfacer2(EmonHubInterfacer):
         if pymodbus_found:
             self._log.info("pymodbus installed")
             self._log.debug("EmonModbusTcpInterfacer2 args: " + str(modbus_IP) + " - " + str(modbus_port))
-            self._con = self._open_modTCP(modbus_IP,modbus_port)
+            # reuse the connection opened before a settings reload, if any
+            self._con = self._inherit('_con', (modbus_IP, modbus_port))
+            if self._con is not None:
+                self._modcon = True
+                self._rNames = {}
+                self._datacodes = {}
+                self._registers = {}
+                self._unitIds = {}
+                self._expectedSize = {}
+            else:
+                self._con = self._open_modTCP(modbus_IP,modbus_port)
             if self._modcon :
                  self._log.info("Modbustcp client Connected")
             else:
@@ -42,24 +54,17 @@ class EmonModbusTcpInterfacer2(EmonHubInterfacer):
 
     # config check given a suffix
     def _check(self,node,suffix):
-        # ehc.nodelist is a json object containing all datas from the [nodes] section of the emonhub.conf file
-        if ehc.nodelist[node]['rx'] is None:
+        # ehc.nodes holds the settings of the [nodes] section of the emonhub.conf file, checked when loaded
+        conf = ehc.nodes.get(node)
+        if conf.error:
+          self._log.error("invalid configuration of node "+node+": "+conf.error)
+          return []
+        if conf.rx is None:
           self._log.error("!!!!!!!!!!!!!!!!!!!!!missing rx section in the node")
           return []
-        else:
-          rx=ehc.nodelist[node]['rx']
-        if suffix+'s' in rx:
-            what = rx[suffix+'s']
-        elif suffix in rx:
-            what = rx[suffix]
-        else:
+        result = list(conf.rx.values(suffix))
+        if not result:
             self._log.debug("please provide a "+suffix+" or a list of "+suffix+"s")
-            return []
-        result=[]
-        if type(what) is list:
-            result = what
-        else:
-            result.append(str(what))
         return result
 
     def set(self, **kwargs):
@@ -103,10 +108,12 @@ class EmonModbusTcpInterfacer2(EmonHubInterfacer):
     def _read_node(self,node):
         """ Read registers from client and create a cargo for the specified node"""
         if pymodbus_found:
-            f = []
+            # datacodes and values read, encoded at once after the last register
+            codes = []
+            values = []
             c = Cargo.new_cargo(rawdata="")
             # check if node has a configuration
-            if node not in ehc.nodelist:
+            if node not in ehc.nodes:
                 self._log.error("node "+node+" not configured")
                 return
             # valid datacodes list and number of registers associated
@@ -119,6 +126,15 @@ class EmonModbusTcpInterfacer2(EmonHubInterfacer):
                 self._log.info("Not connected, retrying connect" + str(self.init_settings))
                 self._con = self._open_modTCP(self.init_settings["modbus_IP"],self.init_settings["modbus_port"])
             
+            # nodes settings reloaded, configs have to be checked again
+            if self._modcon and self._nodes is not ehc.nodes:
+                self._rNames = {}
+                self._datacodes = {}
+                self._registers = {}
+                self._unitIds = {}
+                self._expectedSize = {}
+                self._nodes = ehc.nodes
+
             # connection is opened but the node config has not been checked
             if self._modcon and node not in self._rNames :
                 self._log.info("[node"+node+"]"+"*********checking the config***********")
@@ -142,13 +158,11 @@ class EmonModbusTcpInterfacer2(EmonHubInterfacer):
                 del(registers[lmin:lr])
                 if ld > 1:
                     del(datacodes[lmin:ld])
-                # at this stage, we know that rx section exists 
-                rx=ehc.nodelist[node]['rx']
                 # generate list of unitIds
                 # if nothing is provided, we assume we have to interrogate slave 1
                 unitIds =self._check(node,'unitId')
                 if unitIds==[]:
-                    unitIds.append("1")
+                    unitIds.append(1)
                 # check if number of names and number of unitIds are the same
                 if len(unitIds)> 1 and len(unitIds) != len(rNames):
                     self._log.error("You are using unitIds. You have to define an equal number of UnitIds and of names")
@@ -254,11 +268,11 @@ class EmonModbusTcpInterfacer2(EmonHubInterfacer):
                                 return
                             else:
                                 self._log.debug("RSSI OK")
-                        t = ehc.encode(datacode,rValD)
-                        f = f + list(t)
-                        self._log.debug("Encoded value: " + str(t))
+                        codes.append(datacode)
+                        values.append(rValD)
                         self._log.debug("value: " + str(rValD))
                 
+                f = list(ehc.encode_many(''.join(codes), values))
                 #test if payload length is OK
                 if len(f) == self._expectedSize[node]:
                     self._log.debug("payload size OK (" + str(len(f)) +")")
@@ -293,17 +307,7 @@ class EmonModbusTcpInterfacer2(EmonHubInterfacer):
                     if rxc:
                         rxc = self._process_rx(rxc)
                         if rxc:
-                            for channel in self._settings["pubchannels"]:
-                                self._log.debug(str(rxc.uri) + " Sent to channel(start)' : " + str(channel))
-                                
-                                # Initialize channel if needed
-                                if not channel in self._pub_channels:
-                                    self._pub_channels[channel] = []
-                                
-                                # Add cargo item to channel
-                                self._pub_channels[channel].append(rxc)
-                                
-                                self._log.debug(str(rxc.uri) + " Sent to channel(end)' : " + str(channel))
+                            self._publish(rxc)
             self._log.debug("all modbus 'simili' nodes processed")
             return
         elif 'nodeId' in self._settings:
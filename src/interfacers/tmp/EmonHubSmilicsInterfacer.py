@@ -64,17 +64,7 @@ class EmonHubSmilicsInterfacer(EmonHubInterfacer):
                 if rxc:
                     rxc = self._process_rx(rxc)
                     if rxc:
-                        for channel in self._settings["pubchannels"]:
-                            self._log.debug(str(rxc.uri) + " Sent to channel(start)' : " + str(channel))
-
-                            # Initialize channel if needed
-                            if channel not in self._pub_channels:
-                                self._pub_channels[channel] = []
-
-                            # Add cargo item to channel
-                            self._pub_channels[channel].append(rxc)
-
-                            self._log.debug(str(rxc.uri) + " Sent to channel(end)' : " + str(channel))
+                        self._publish(rxc)
 
             # Don't loop too fast
             time.sleep(0.1)